@@ -0,0 +1,5 @@
+"""Reproducible benchmarks for the cmpt365 codecs and BMP decoders
+
+    python -m benchmarks.run --preset quick --output results.json
+    python -m benchmarks.run --preset quick --baseline results.json
+"""
@@ -0,0 +1,106 @@
+"""Deterministic synthetic BMP corpus covering every bit depth, content type and size"""
+import zlib
+
+import numpy as np
+
+from cmpt365.bmp import bmp_row_bytes, build_bmp_header
+
+BIT_DEPTHS = (1, 4, 8, 24)
+CONTENTS = ("flat", "noise", "gradient", "photo")
+SIZES = {
+    "icon": (32, 32),
+    "small": (256, 256),
+    "vga": (640, 480),
+    "hd": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+PRESETS = {
+    "quick": ("icon", "small", "vga"),
+    "standard": ("icon", "small", "vga", "hd"),
+    "full": tuple(SIZES),
+}
+
+#Name of a corpus case, also used as the key in result files
+def case_name(bpp, content, size):
+    width, height = SIZES[size]
+    return f"{bpp}bpp-{content}-{size}-{width}x{height}"
+
+#Every (bpp, content, size) combination of a preset, optionally filtered
+def corpus_cases(preset="quick", bit_depths=BIT_DEPTHS, contents=CONTENTS):
+    return [(bpp, content, size) for size in PRESETS[preset] for bpp in bit_depths for content in contents]
+
+#Smooth random field: a coarse random grid upsampled with bilinear interpolation
+def _smooth_noise(rng, width, height, cell, channels):
+    grid = rng.random(((height + cell - 1) // cell + 2, (width + cell - 1) // cell + 2, channels))
+    ys = np.arange(height) / cell
+    xs = np.arange(width) / cell
+    y0 = ys.astype(np.int64)
+    x0 = xs.astype(np.int64)
+    fy = (ys - y0)[:, None, None]
+    fx = (xs - x0)[None, :, None]
+    top = grid[y0][:, x0] * (1 - fx) + grid[y0][:, x0 + 1] * fx
+    bottom = grid[y0 + 1][:, x0] * (1 - fx) + grid[y0 + 1][:, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+#(height, width, 3) float field in [0, 1] with the requested content
+def make_field(content, width, height, rng):
+    if content == "flat":
+        return np.broadcast_to(np.array([0.2, 0.5, 0.8]), (height, width, 3))
+    if content == "noise":
+        return rng.random((height, width, 3))
+    if content == "gradient":
+        y, x = np.mgrid[0:height, 0:width]
+        return np.stack([x / max(1, width - 1), y / max(1, height - 1),
+                         (x + y) / max(1, width + height - 2)], axis=-1)
+    if content == "photo":
+        # Soft lighting, a few hard-edged objects and mild sensor noise
+        field = _smooth_noise(rng, width, height, max(4, min(width, height) // 6), 3) * 0.7
+        field += _smooth_noise(rng, width, height, max(2, min(width, height) // 40), 3) * 0.2
+        y, x = np.mgrid[0:height, 0:width]
+        for _ in range(6):
+            cx, cy = rng.random(2) * (width, height)
+            radius = rng.uniform(0.05, 0.25) * min(width, height)
+            inside = (x - cx) ** 2 + (y - cy) ** 2 < radius ** 2
+            field[inside] = field[inside] * 0.3 + rng.random(3) * 0.7
+        field += rng.normal(0, 0.02, field.shape)
+        return np.clip(field, 0, 1)
+    raise ValueError(f"Unknown content: {content}")
+
+#Grey ramp color table for palettized depths
+def gray_color_table(bpp):
+    levels = np.linspace(0, 255, 1 << bpp).astype(np.uint8)
+    return np.stack([levels, levels, levels, np.zeros_like(levels)], axis=-1).tobytes()
+
+#Pack display-order pixels into bottom-up padded BMP rows
+def pack_rows(pixels, bpp, width):
+    height = pixels.shape[0]
+    if bpp == 24:
+        rows = pixels[:, :, ::-1].reshape(height, -1)
+    elif bpp == 8:
+        rows = pixels
+    elif bpp == 4:
+        even = np.zeros((height, width + width % 2), dtype=np.uint8)
+        even[:, :width] = pixels
+        rows = (even[:, 0::2] << 4) | even[:, 1::2]
+    else:
+        rows = np.packbits(pixels, axis=1)
+
+    stored = np.zeros((height, bmp_row_bytes(width, bpp)), dtype=np.uint8)
+    stored[:, :rows.shape[1]] = rows
+    return stored[::-1].tobytes()
+
+#Build one BMP file, the same bytes for the same arguments on every run
+def make_bmp(bpp, content, width, height, seed=0):
+    rng = np.random.default_rng([seed, bpp, zlib.crc32(content.encode()), width, height])
+    field = make_field(content, width, height, rng)
+    if bpp == 24:
+        pixels = np.round(field * 255).astype(np.uint8)
+        color_table = bytes()
+    else:
+        luminance = field @ np.array([0.299, 0.587, 0.114])
+        pixels = np.minimum((luminance * (1 << bpp)).astype(np.uint8), (1 << bpp) - 1)
+        color_table = gray_color_table(bpp)
+
+    pixel_bytes = pack_rows(pixels, bpp, width)
+    return build_bmp_header(width, height, bpp, color_table, len(pixel_bytes)) + color_table + pixel_bytes
@@ -0,0 +1,195 @@
+"""Time every codec stage over the synthetic corpus and compare against a baseline
+
+Each stage is timed as the best of --repeat runs and, unless --no-memory is
+given, run once more under tracemalloc for its peak allocation. Throughput is
+always measured against the uncompressed pixel payload of the case.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+import cmpt365
+
+from .corpus import BIT_DEPTHS, CONTENTS, PRESETS, SIZES, case_name, corpus_cases, make_bmp
+
+RESULTS_VERSION = 1
+
+class Case:
+    """One corpus image, on disk and as its stored pixel payload"""
+    def __init__(self, bpp, content, size, directory, seed=0):
+        width, height = SIZES[size]
+        self.name = case_name(bpp, content, size)
+        self.path = os.path.join(directory, self.name + ".bmp")
+        with open(self.path, 'wb') as f:
+            f.write(make_bmp(bpp, content, width, height, seed))
+        with cmpt365.BMPReader(self.path) as reader:
+            self.pixels = bytes(reader.pixel_bytes)
+            self.color_table = bytes(reader.color_table)
+            self.row_bytes = reader.row_bytes
+            self.bpp = reader.bpp
+            self.stride = cmpt365.filter_stride(reader.bpp)
+
+#open_file-style decoding: map the BMP and materialize the RGB array
+def decode_bmp(path):
+    with cmpt365.BMPReader(path) as reader:
+        return reader.decode()
+
+#compress_bmp followed by open_cmpt365, without the GUI
+def round_trip(path):
+    cmpt_data, method, sizes = cmpt365.compress_bmp_file(path)
+    width, height, bpp, method, color_table, pixels = cmpt365.decompress_cmpt365(cmpt_data)
+    return cmpt365.decode_pixel_array(pixels, width, height, bpp, color_table)
+
+#Fixed match distances the LZSS stages use for a case
+def lzss_distances(case):
+    return cmpt365.lzss_fixed_distances(case.row_bytes, case.stride)
+
+#LZSS streams and extra bits of a case, as lzss_rebuild takes them
+def lzss_streams(case):
+    starts, lengths, distances = cmpt365.lzss_parse(case.pixels, case.row_bytes, case.stride)
+    streams, extra = cmpt365.lzss_streams(case.pixels, starts, lengths, distances, lzss_distances(case))
+    return streams + [extra]
+
+# Stage name -> setup(case) returning the untimed-setup, zero-argument call to time
+STAGES = {
+    "huffman_compress": lambda case: partial(cmpt365.huffman_compress, case.pixels),
+    "huffman_decompress": lambda case: partial(
+        cmpt365.huffman_decompress, *cmpt365.huffman_compress(case.pixels)),
+    "serialize_huffman_tree": lambda case: partial(
+        cmpt365.serialize_huffman_tree, cmpt365.build_huffman_tree(case.pixels)),
+    "deserialize_huffman_tree": lambda case: partial(
+        cmpt365.deserialize_huffman_tree, cmpt365.serialize_huffman_tree(cmpt365.build_huffman_tree(case.pixels))),
+    "canonical_huffman_compress": lambda case: partial(cmpt365.canonical_huffman_compress, case.pixels),
+    "canonical_huffman_decompress": lambda case: partial(
+        cmpt365.canonical_huffman_decompress, *cmpt365.canonical_huffman_compress(case.pixels)),
+    "rle_compress": lambda case: partial(cmpt365.rle_compress, case.pixels),
+    "rle_decompress": lambda case: partial(cmpt365.rle_decompress, cmpt365.rle_compress(case.pixels)),
+    "filter_rows": lambda case: partial(cmpt365.filter_rows, case.pixels, case.row_bytes, case.stride),
+    "unfilter_rows": lambda case: partial(
+        cmpt365.unfilter_rows, cmpt365.filter_rows(case.pixels, case.row_bytes, case.stride), case.row_bytes, case.stride),
+    "lzss_parse": lambda case: partial(cmpt365.lzss_parse, case.pixels, case.row_bytes, case.stride),
+    "lzss_rebuild": lambda case: partial(cmpt365.lzss_rebuild, *lzss_streams(case), 4, lzss_distances(case)),
+    "bmp_decode": lambda case: partial(decode_bmp, case.path),
+    "round_trip": lambda case: partial(round_trip, case.path),
+}
+
+#Best and median wall time of repeated calls, in seconds
+def time_call(call, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+#Peak traced allocation of one call, in bytes
+def peak_memory(call):
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+#Benchmark every stage on one case, returning a list of result records
+def run_case(case, stages, repeat, measure_memory):
+    results = []
+    for stage in stages:
+        call = STAGES[stage](case)
+        best, median = time_call(call, repeat)
+        record = {
+            "case": case.name,
+            "stage": stage,
+            "bytes": len(case.pixels),
+            "best_s": best,
+            "median_s": median,
+            "mb_per_s": len(case.pixels) / best / 1e6 if best > 0 else None,
+        }
+        if measure_memory:
+            record["peak_bytes"] = peak_memory(call)
+        results.append(record)
+    return results
+
+#Compare results against a baseline, returning (rows, regressions) keyed by (case, stage)
+def compare(results, baseline, tolerance):
+    previous = {(r["case"], r["stage"]): r for r in baseline["results"]}
+    rows = []
+    regressions = []
+    for record in results:
+        old = previous.get((record["case"], record["stage"]))
+        if old is None:
+            continue
+        speedup = old["best_s"] / record["best_s"] if record["best_s"] > 0 else float("inf")
+        rows.append((record["case"], record["stage"], speedup))
+        if speedup < 1 - tolerance:
+            regressions.append((record["case"], record["stage"], speedup))
+    return rows, regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.split("\n")[0])
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick", help="image sizes to generate")
+    parser.add_argument("--bpp", type=int, nargs="+", choices=BIT_DEPTHS, default=BIT_DEPTHS)
+    parser.add_argument("--content", nargs="+", choices=CONTENTS, default=CONTENTS)
+    parser.add_argument("--stage", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed (default: 0)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory run")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against a results JSON file from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="slowdown against the baseline reported as a regression (default: 0.10)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for bpp, content, size in corpus_cases(args.preset, args.bpp, args.content):
+            case = Case(bpp, content, size, directory, args.seed)
+            for record in run_case(case, args.stage, args.repeat, not args.no_memory):
+                peak = record.get("peak_bytes")
+                peak_text = f"{peak / 1e6:9.2f} MB peak" if peak is not None else ""
+                print(f"{record['case']:<32} {record['stage']:<30} {record['mb_per_s'] or 0:9.2f} MB/s {peak_text}")
+                results.append(record)
+            os.remove(case.path)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "preset": args.preset,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        rows, regressions = compare(results, json.load(f), args.tolerance)
+    print(f"\nAgainst {args.baseline} ({len(rows)} matching measurements):")
+    for name, stage, speedup in rows:
+        print(f"{name:<32} {stage:<30} {speedup:6.2f}x")
+    for name, stage, speedup in regressions:
+        print(f"REGRESSION {name} {stage}: {speedup:.2f}x baseline speed", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
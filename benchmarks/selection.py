@@ -0,0 +1,99 @@
+"""Report how often sampled method selection agrees with exact selection over the corpus
+
+For every case both selectors run on the stored pixel payload. A miss
+costs the exact size of the method the sample picked over the exact size
+of the best method, so the report shows both how often the sample is
+wrong and how much it matters when it is.
+
+The codec sizes payloads exactly when a SAMPLE_MIN_BYTES sample would
+cover most of them, which is every image of the smaller presets, so by
+default the sample is taken at --fraction however small the image is.
+Pass --min-bytes to compare at the codec's own floor instead; cases it
+sizes exactly are counted separately.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cmpt365
+from cmpt365.codec import SAMPLE_FRACTION, SAMPLE_MARGIN, SAMPLE_MIN_BYTES, select_method, select_method_sampled
+
+from .corpus import BIT_DEPTHS, CONTENTS, PRESETS, corpus_cases
+from .run import Case
+
+#Run both selectors on one case, returning a result record
+def compare_selection(case, fraction, margin, min_bytes=0):
+    start = time.perf_counter()
+    exact_method, exact_sizes = select_method(case.pixels, case.color_table, case.row_bytes, case.bpp)
+    exact_s = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    sampled_method, sampled_sizes, sampled_fraction = select_method_sampled(
+        case.pixels, case.color_table, case.row_bytes, case.bpp, fraction, margin, min_bytes=min_bytes)
+    sampled_s = time.perf_counter() - start
+    
+    return {
+        "case": case.name,
+        "bytes": len(case.pixels),
+        "exact_method": exact_method,
+        "sampled_method": sampled_method,
+        "match": exact_method == sampled_method,
+        # Extra bytes the sampled choice costs, as a share of the best size
+        "penalty": exact_sizes[sampled_method] / exact_sizes[exact_method] - 1,
+        "estimate_error": sampled_sizes[sampled_method] / exact_sizes[sampled_method] - 1,
+        "fraction": sampled_fraction,
+        "exact_s": exact_s,
+        "sampled_s": sampled_s,
+    }
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.selection", description=__doc__.split("\n")[0])
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick", help="image sizes to generate")
+    parser.add_argument("--bpp", type=int, nargs="+", choices=BIT_DEPTHS, default=BIT_DEPTHS)
+    parser.add_argument("--content", nargs="+", choices=CONTENTS, default=CONTENTS)
+    parser.add_argument("--fraction", type=float, default=SAMPLE_FRACTION,
+                        help=f"share of the rows in the first sample (default: {SAMPLE_FRACTION})")
+    parser.add_argument("--margin", type=float, default=SAMPLE_MARGIN,
+                        help=f"closeness of the two best estimates that grows the sample (default: {SAMPLE_MARGIN})")
+    parser.add_argument("--min-bytes", type=int, default=0,
+                        help=f"smallest sample; the codec uses {SAMPLE_MIN_BYTES} (default: 0, sample every case)")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed (default: 0)")
+    parser.add_argument("--output", help="write results to this JSON file")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for bpp, content, size in corpus_cases(args.preset, args.bpp, args.content):
+            case = Case(bpp, content, size, directory, args.seed)
+            record = compare_selection(case, args.fraction, args.margin, args.min_bytes)
+            results.append(record)
+            os.remove(case.path)
+            names = cmpt365.COMPRESSION_METHODS
+            verdict = "match" if record["match"] else f"MISS +{record['penalty']:.2%}"
+            print(f"{record['case']:<32} {names[record['exact_method']]:<28} {names[record['sampled_method']]:<28} "
+                  f"{verdict:<14} {record['fraction']:6.3f} {record['exact_s'] / max(record['sampled_s'], 1e-9):6.2f}x")
+    
+    matches = sum(record["match"] for record in results)
+    total_exact = sum(record["exact_s"] for record in results)
+    total_sampled = sum(record["sampled_s"] for record in results)
+    print(f"\nSampled choice matched the exact one in {matches} of {len(results)} cases "
+          f"({matches / len(results):.1%})")
+    print(f"Worst size penalty: {max(record['penalty'] for record in results):.2%}, "
+          f"mean: {sum(record['penalty'] for record in results) / len(results):.2%}")
+    print(f"Selection time: {total_exact:.2f} s exact, {total_sampled:.2f} s sampled")
+    unsampled = sum(record["fraction"] == 1.0 for record in results)
+    if unsampled:
+        print(f"{unsampled} of {len(results)} cases were below --min-bytes and sized exactly by both selectors")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"fraction": args.fraction, "margin": args.margin, "min_bytes": args.min_bytes, "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
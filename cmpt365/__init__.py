@@ -0,0 +1,65 @@
+"""Headless codecs, container format and BMP parsing behind the .cmpt365 viewer.
+
+Nothing here touches tkinter or PIL. Submodules are imported on first
+attribute access, so ``import cmpt365`` stays in the millisecond range and
+NumPy is only loaded once a codec is actually used:
+
+    import cmpt365
+    cmpt_data, method, sizes = cmpt365.compress_bmp_file("image.bmp")
+    width, height, bpp, method, color_table, pixels = cmpt365.decompress_cmpt365(cmpt_data)
+"""
+import importlib
+
+# Public names and the submodule that defines each of them
+_SUBMODULE_EXPORTS = {
+    "huffman": (
+        "HuffmanNode", "build_huffman_tree", "build_huffman_codes", "huffman_compress",
+        "huffman_decompress", "serialize_huffman_tree", "deserialize_huffman_tree",
+        "huffman_code_lengths", "canonical_code_table", "serialize_code_lengths",
+        "deserialize_code_lengths", "canonical_huffman_size", "canonical_huffman_compress",
+        "canonical_huffman_decompress", "iter_huffman_decompress", "iter_canonical_huffman_decompress",
+    ),
+    "rle": ("rle_compress", "rle_decompress", "rle_statistics"),
+    "bmp": (
+        "BMPReader", "bmp_row_bytes", "decode_rows", "decode_pixel_array", "iter_pixel_bands",
+        "build_bmp_header", "parse_bmp_header",
+    ),
+    "container": (
+        "COMPRESSION_METHODS", "CMPT365_HEADER_SIZE", "build_cmpt365", "read_cmpt365_header",
+        "cmpt365_size", "block_ranges",
+    ),
+    "codec": (
+        "SerialExecutor", "get_process_pool", "get_thread_pool", "decompress_payload", "iter_decompress_payload",
+        "predict_parts", "predict_sizes", "encode_method", "compress_blocks", "decompress_blocks", "select_method",
+        "estimate_sizes", "select_method_sampled", "compress_pixels", "compress_bmp_file", "decompress_cmpt365",
+    ),
+    "filters": ("FILTER_TYPES", "filter_stride", "filter_rows", "unfilter_rows"),
+    "planar": ("PLANE_NAMES", "split_planes", "merge_planes", "plane_histograms"),
+    "lzss": ("LZSS_EFFORT_CHAINS", "lzss_fixed_distances", "lzss_parse", "lzss_cut_parse", "lzss_streams",
+             "lzss_rebuild"),
+    "catalog": ("CATALOG_FIELDS", "read_header_record", "iter_catalog_paths", "iter_catalog", "write_catalog"),
+    "stream": ("iter_cmpt365_payload", "compress_stream", "decompress_stream"),
+    "resize": ("scaled_size", "resize_nearest", "resize_area", "resize_image"),
+    "pyramid": ("fit_scale", "ImagePyramid"),
+    "adjust": ("brightness_lut", "ImageAdjuster"),
+    "cache": ("LRUCache", "DecodeCache", "file_key", "content_key"),
+    "tasks": ("Cancelled", "Task", "TaskQueue"),
+    "instrument": ("Stats", "StageStats", "recording", "stage", "add_stage_hook", "remove_stage_hook"),
+}
+
+_EXPORTS = {name: module for module, names in _SUBMODULE_EXPORTS.items() for name in names}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
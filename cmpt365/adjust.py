@@ -0,0 +1,66 @@
+"""Display adjustments (scale, brightness, channel mask) with cached intermediates"""
+import numpy as np
+
+from .cache import LRUCache
+from .pyramid import ImagePyramid
+from .resize import resize_image
+
+# Bytes of intermediate images kept per ImageAdjuster
+ADJUST_CACHE_BYTES = 256 << 20
+
+#256-entry table equal to (value * brightness).astype(np.uint8) for every uint8 value
+def brightness_lut(brightness):
+    return (np.arange(256) * brightness).astype(np.uint8)
+
+class ImageAdjuster:
+    """Scale, brightness and channel mask applied to one source image.
+
+    Scaling starts from the smallest pyramid level at least as large as the
+    requested size, so only scales above 1/2 ever read the full-resolution
+    source. Brightness is a 256-entry lookup table applied after resizing,
+    and the channel mask goes on last, onto the smallest array. Every
+    intermediate is cached by the parameters that produced it, so changing
+    only the mask or only the brightness skips every earlier step. Returned
+    arrays are read-only and may be shared with the cache or the source.
+    """
+    def __init__(self, source, max_bytes=ADJUST_CACHE_BYTES):
+        self.source = source
+        self.pyramid = ImagePyramid(source)
+        self.cache = LRUCache(max_bytes)
+
+    def resized(self, scale, method="nearest"):
+        key = ("resized", scale, method)
+        image = self.cache.get(key)
+        if image is None:
+            level, size = self.pyramid.level_for_scale(scale)
+            image = resize_image(level, scale, method, size)
+            if image is not level:
+                image.setflags(write=False)
+                self.cache.put(key, image)
+        return image
+
+    def brightened(self, scale, brightness, method="nearest"):
+        resized = self.resized(scale, method)
+        if brightness == 1:
+            return resized
+        key = ("brightened", scale, method, brightness)
+        image = self.cache.get(key)
+        if image is None:
+            image = np.take(brightness_lut(brightness), resized)
+            image.setflags(write=False)
+            self.cache.put(key, image)
+        return image
+
+    def render(self, scale, brightness, channels=(True, True, True), method="nearest"):
+        """Adjusted image; channels says which of R, G and B stay visible"""
+        channels = tuple(bool(visible) for visible in channels)
+        image = self.brightened(scale, brightness, method)
+        if all(channels):
+            return image
+        key = ("rendered", scale, method, brightness, channels)
+        masked = self.cache.get(key)
+        if masked is None:
+            masked = image * np.array(channels, dtype=np.uint8)
+            masked.setflags(write=False)
+            self.cache.put(key, masked)
+        return masked
@@ -0,0 +1,250 @@
+"""BMP parsing: pixel decoding, the memory-mapped reader and header writing"""
+import mmap
+
+import numpy as np
+
+from .instrument import stage, timed_stage
+
+# ============= BMP PIXEL DECODING =============
+
+#Number of bytes in one stored BMP row, including the padding to 4 bytes
+def bmp_row_bytes(width, bpp):
+    return ((width * bpp + 31) // 32) * 4
+
+#Turn a BMP color table (B, G, R, reserved entries) into a (256, 3) RGB palette
+def color_table_to_palette(color_table):
+    entries = len(color_table) // 4
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    if entries:
+        table = np.frombuffer(color_table, dtype=np.uint8, count=min(entries, 256) * 4)
+        palette[:entries] = table.reshape(-1, 4)[:, 2::-1]
+    return palette
+
+#Decode stored BMP rows (one per array row, already in display order) into RGB pixels
+def decode_rows(rows, bpp, color_table=bytes(), start=0, width=None):
+    if bpp not in (1, 4, 8, 24):
+        raise ValueError(f"Unsupported bit depth: {bpp}")
+    if width is None:
+        width = rows.shape[1] * 8 // bpp - start
+
+    if bpp == 24:
+        bgr = rows[:, start * 3:(start + width) * 3].reshape(rows.shape[0], width, 3)
+        return np.ascontiguousarray(bgr[:, :, ::-1])
+
+    if bpp == 1:
+        indices = np.unpackbits(rows, axis=1)
+    elif bpp == 4:
+        indices = np.empty((rows.shape[0], rows.shape[1] * 2), dtype=np.uint8)
+        indices[:, 0::2] = rows >> 4
+        indices[:, 1::2] = rows & 0xF
+    else:  # 8
+        indices = rows
+
+    return color_table_to_palette(color_table)[indices[:, start:start + width]]
+
+#Decode bottom-up BMP pixel rows into a top-down (height, width, 3) RGB array
+@timed_stage("reconstruct")
+def decode_pixel_array(pixel_bytes, width, height, bpp, color_table=bytes()):
+    if bpp not in (1, 4, 8, 24):
+        raise ValueError(f"Unsupported bit depth: {bpp}")
+
+    row_bytes = bmp_row_bytes(width, bpp)
+    needed = row_bytes * height
+    raw = np.frombuffer(memoryview(pixel_bytes)[:needed], dtype=np.uint8)
+    if raw.size < needed:
+        # Truncated payloads decode as black instead of failing
+        raw = np.concatenate([raw, np.zeros(needed - raw.size, dtype=np.uint8)])
+
+    # Flip to top-down order first so the final gather writes a contiguous array
+    return decode_rows(raw.reshape(height, row_bytes)[::-1], bpp, color_table, 0, width)
+
+#Decode a stream of bottom-up pixel payload chunks into RGB bands as their rows complete
+def iter_pixel_bands(chunks, width, height, bpp, color_table=bytes()):
+    """Yield (top, band) for each run of completed rows, bottom band first as
+    BMP stores them; top is the display row of the band's first row. Bytes
+    past the last row are ignored and a truncated payload just stops early."""
+    if bpp not in (1, 4, 8, 24):
+        raise ValueError(f"Unsupported bit depth: {bpp}")
+
+    row_bytes = bmp_row_bytes(width, bpp)
+    pending = bytearray()
+    done = 0
+    for chunk in chunks:
+        pending += chunk
+        rows = min(len(pending) // row_bytes, height - done)
+        if rows == 0:
+            continue
+        with stage("reconstruct", rows * row_bytes) as s:
+            stored = np.frombuffer(pending, dtype=np.uint8, count=rows * row_bytes).reshape(rows, row_bytes)
+            band = decode_rows(stored[::-1], bpp, color_table, width=width)
+            s.bytes_out = band.nbytes
+        # The view must be gone before the buffer can shrink
+        del stored
+        del pending[:rows * row_bytes]
+        done += rows
+        yield height - done, band
+        if done == height:
+            return
+
+# ============= MEMORY-MAPPED BMP READER =============
+
+# Stored bytes per band when a BMP is decoded progressively
+PROGRESSIVE_BAND_BYTES = 1 << 20
+
+#Parse the fixed header at the start of a BMP file
+def parse_bmp_header(header):
+    """Return (file_size, pixel_offset, width, height, top_down, bpp)"""
+    if len(header) < 30 or header[0:2] != b"BM":
+        raise ValueError("Not a BMP file")
+    
+    file_size = int.from_bytes(header[2:6], "little")
+    pixel_offset = int.from_bytes(header[10:14], "little")
+    width = int.from_bytes(header[18:22], "little")
+    stored_height = int.from_bytes(header[22:26], "little", signed=True)
+    bpp = int.from_bytes(header[28:30], "little")
+    if bpp not in (1, 4, 8, 24):
+        raise ValueError(f"Unsupported bit depth: {bpp}")
+    return file_size, pixel_offset, width, abs(stored_height), stored_height < 0, bpp
+
+class BMPReader:
+    """Lazy, memory-mapped access to the header, rows and tiles of a BMP file.
+
+    Opening only parses the fixed header; every row, row range or tile is a
+    zero-copy NumPy view into the mapping until decode_tile() is called.
+    Row and tile coordinates are in display order (row 0 is the top row).
+    Views keep the mapping alive, so close() releases it once they are gone.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("Not a BMP file") from None
+
+        try:
+            (self.file_size, self.pixel_offset, self.width, self.height, self.top_down,
+             self.bpp) = parse_bmp_header(self._map[:54])
+        except ValueError:
+            self.close()
+            raise
+        self.row_bytes = bmp_row_bytes(self.width, self.bpp)
+
+        if self.pixel_offset + self.row_bytes * self.height > len(self._map):
+            self.close()
+            raise ValueError("BMP pixel data is truncated")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            # Views are still exported; the mapping is released with the last one
+            pass
+
+    @property
+    def size(self):
+        return len(self._map)
+
+    @property
+    def color_table(self):
+        if self.bpp > 8:
+            return bytes()
+        return self._map[54:self.pixel_offset]
+
+    @property
+    def pixel_bytes(self):
+        """Everything from the pixel offset to the end of the file, as stored"""
+        return memoryview(self._map)[self.pixel_offset:]
+
+    def bottom_up_pixel_bytes(self):
+        """pixel_bytes with the rows in bottom-up order, as .cmpt365 payloads
+        store them; top-down files are copied, bottom-up ones are not"""
+        if not self.top_down:
+            return self.pixel_bytes
+        rows_end = self.pixel_offset + self.row_bytes * self.height
+        return memoryview(self.raw_rows()[::-1].tobytes() + self._map[rows_end:])
+
+    def raw_rows(self):
+        """(height, row_bytes) view of the stored rows in display order"""
+        rows = np.frombuffer(self._map, dtype=np.uint8, count=self.row_bytes * self.height,
+                             offset=self.pixel_offset).reshape(self.height, self.row_bytes)
+        return rows if self.top_down else rows[::-1]
+
+    def row(self, y):
+        return self.raw_rows()[y]
+
+    def rows(self, start, stop):
+        return self.raw_rows()[start:stop]
+
+    def tile(self, x, y, width, height):
+        """Stored bytes covering a rectangle: (h, w, 3) BGR for 24 bpp, (h, w) indices
+        for 8 bpp, and the whole bytes spanning the columns for 1 and 4 bpp.
+        Rectangles running past the right or bottom edge are clamped to the image."""
+        width = max(0, min(width, self.width - x))
+        height = max(0, min(height, self.height - y))
+        rows = self.raw_rows()[y:y + height]
+        if self.bpp == 24:
+            return rows[:, x * 3:(x + width) * 3].reshape(rows.shape[0], -1, 3)
+        first = x * self.bpp // 8
+        last = ((x + width) * self.bpp + 7) // 8
+        return rows[:, first:last]
+
+    def decode_tile(self, x, y, width, height):
+        """Materialize a rectangle as an RGB array"""
+        raw = self.tile(x, y, width, height)
+        if self.bpp == 24:
+            return np.ascontiguousarray(raw[:, :, ::-1])
+        start = x - (x * self.bpp // 8) * 8 // self.bpp
+        width = max(0, min(width, self.width - x))
+        return decode_rows(raw, self.bpp, self.color_table, start, width)
+
+    def iter_bands(self, rows_per_band=None):
+        """Yield (top, band) decoded in stored order, so bottom-up files give
+        their bottom band first; bands default to about PROGRESSIVE_BAND_BYTES"""
+        if rows_per_band is None:
+            rows_per_band = max(1, PROGRESSIVE_BAND_BYTES // self.row_bytes)
+        for stored_start in range(0, self.height, rows_per_band):
+            rows = min(rows_per_band, self.height - stored_start)
+            top = stored_start if self.top_down else self.height - stored_start - rows
+            with stage("reconstruct", self.row_bytes * rows) as s:
+                band = self.decode_tile(0, top, self.width, rows)
+                s.bytes_out = band.nbytes
+            yield top, band
+
+    def decode(self):
+        with stage("reconstruct", self.row_bytes * self.height) as s:
+            pixels = self.decode_tile(0, 0, self.width, self.height)
+            s.bytes_out = pixels.nbytes
+        return pixels
+
+# ============= BMP WRITING =============
+
+# File header plus BITMAPINFOHEADER
+BMP_HEADER_SIZE = 54
+
+#Build the 54 byte header of an uncompressed BMP
+def build_bmp_header(width, height, bpp, color_table, pixel_size):
+    pixel_offset = BMP_HEADER_SIZE + len(color_table)
+    header = bytearray()
+    header.extend(b'BM')
+    header.extend((pixel_offset + pixel_size).to_bytes(4, 'little'))
+    header.extend(bytes(4))  # reserved
+    header.extend(pixel_offset.to_bytes(4, 'little'))
+    header.extend((40).to_bytes(4, 'little'))  # BITMAPINFOHEADER
+    header.extend(width.to_bytes(4, 'little', signed=True))
+    header.extend(height.to_bytes(4, 'little', signed=True))
+    header.extend((1).to_bytes(2, 'little'))  # planes
+    header.extend(bpp.to_bytes(2, 'little'))
+    header.extend(bytes(4))  # BI_RGB
+    header.extend(pixel_size.to_bytes(4, 'little'))
+    header.extend((2835).to_bytes(4, 'little'))  # 72 DPI
+    header.extend((2835).to_bytes(4, 'little'))
+    header.extend((len(color_table) // 4 if bpp <= 8 else 0).to_bytes(4, 'little'))
+    header.extend(bytes(4))  # important colors
+    return bytes(header)
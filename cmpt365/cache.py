@@ -0,0 +1,184 @@
+"""Least-recently-used caches bounded by the bytes they hold"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .instrument import stage
+
+#Bytes held by a cached value: arrays report nbytes, bytes-like values their length
+def value_nbytes(value):
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+class LRUCache:
+    """Mapping that evicts its least recently used entries once max_bytes is exceeded
+
+    A single value larger than max_bytes is not stored at all.
+    """
+    def __init__(self, max_bytes, sizeof=value_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        self.discard(key)
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            evicted_key, (evicted, evicted_size) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_size
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+# ============= DECODED IMAGE CACHE =============
+
+# Bytes of decoded images kept in memory, and on disk when a directory is given
+DECODE_CACHE_BYTES = 1 << 30
+DECODE_DISK_BYTES = 8 << 30
+
+#Cache key naming a file by its resolved path, modification time and size
+def file_key(path):
+    st = os.stat(path)
+    return "file", os.path.realpath(path), st.st_mtime_ns, st.st_size
+
+#Cache key naming a file by a hash of its bytes, so copies and renames share an entry
+def content_key(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return "content", digest.hexdigest()
+
+class DecodeCache:
+    """Decoded images by file, in an LRUCache with an optional .npy directory behind it
+
+    Entries are keyed by key(path), which defaults to file_key, so editing a
+    file invalidates it; content_key trades a read of the whole file for
+    sharing entries between copies. With a directory, every stored image is
+    also saved there as <key hash>.npy and a memory miss reopens it as a
+    read-only memory map, so hits survive restarts and are not copied in.
+    The oldest files are removed once the directory holds more than
+    max_disk_bytes. Cached arrays are read-only and shared between callers.
+    """
+    def __init__(self, max_bytes=DECODE_CACHE_BYTES, directory=None, max_disk_bytes=DECODE_DISK_BYTES,
+                 key=file_key):
+        self.memory = LRUCache(max_bytes)
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.key = key
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        name = hashlib.blake2b(repr(key).encode(), digest_size=20).hexdigest()
+        return os.path.join(self.directory, name + ".npy")
+
+    def get(self, path):
+        """Decoded image of the file at path, or None"""
+        with stage("cache") as s:
+            key = self.key(path)
+            with self._lock:
+                pixels = self.memory.get(key)
+            if pixels is None and self.directory is not None:
+                pixels = self._load(key)
+                if pixels is not None:
+                    with self._lock:
+                        self.memory.put(key, pixels)
+            if pixels is not None:
+                s.bytes_out = pixels.nbytes
+        return pixels
+
+    def put(self, path, pixels):
+        """Store the decoded image of the file at path; returns the cached read-only
+        view, leaving the caller's own array writable"""
+        view = pixels.view()
+        view.setflags(write=False)
+        key = self.key(path)
+        with self._lock:
+            self.memory.put(key, view)
+        if self.directory is not None:
+            with stage("cache", view.nbytes):
+                self._save(key, view)
+        return view
+
+    def _load(self, key):
+        disk_path = self._disk_path(key)
+        try:
+            pixels = np.load(disk_path, mmap_mode='r')
+            os.utime(disk_path)
+        except (OSError, ValueError):
+            return None
+        return pixels
+
+    def _save(self, key, pixels):
+        # Written under a temporary name so a reader never maps a partial file
+        disk_path = self._disk_path(key)
+        tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            np.save(tmp_path, pixels, allow_pickle=False)
+            os.replace(tmp_path + ".npy", disk_path)
+        finally:
+            if os.path.exists(tmp_path + ".npy"):
+                os.remove(tmp_path + ".npy")
+        self._prune()
+
+    #Remove the least recently used files until the directory fits in max_disk_bytes
+    def _prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npy") and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self, disk=False):
+        with self._lock:
+            self.memory.clear()
+        if disk and self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npy"):
+                    os.remove(entry.path)
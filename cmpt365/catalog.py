@@ -0,0 +1,115 @@
+"""Header-only catalogue of BMP and .cmpt365 files
+
+Only the fixed header of each file is read, so cataloguing costs one open
+and one small read per file however large the images are:
+
+    python -m cmpt365 catalog archive/ -o catalog.csv
+
+Files are read in batches on a thread pool, and records come back in the
+order the files were found.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .bmp import BMP_HEADER_SIZE, bmp_row_bytes, parse_bmp_header
+from .container import COMPRESSION_METHODS, read_cmpt365_header
+from .stream import iter_bounded_map
+
+# Columns of a catalogue, in output order
+CATALOG_FIELDS = ("path", "format", "file_size", "width", "height", "bpp", "method", "method_name",
+                  "raw_size", "ratio", "error")
+CATALOG_EXTENSIONS = (".bmp", ".cmpt365")
+CATALOG_FORMATS = ("csv", "json")
+# Files read per pool task; batching keeps the per-file cost near a single open and read
+CATALOG_BATCH = 256
+CATALOG_WORKERS = 32
+
+#Catalogue record of one file, read from its header alone
+def read_header_record(path):
+    """raw_size is the size of the file as an uncompressed BMP and ratio is
+    raw_size over file_size; files whose header cannot be read keep their
+    path and size and say why in error."""
+    record = dict.fromkeys(CATALOG_FIELDS)
+    record["path"] = path
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            record["file_size"] = file_size
+            if f.read(7) == b'CMPT365':
+                f.seek(0)
+                width, height, bpp, method, padding, color_table_len, table_len = read_cmpt365_header(f)
+                raw_size = BMP_HEADER_SIZE + color_table_len + bmp_row_bytes(width, bpp) * height
+                record.update(format="cmpt365", method=method, method_name=COMPRESSION_METHODS[method])
+            else:
+                f.seek(0)
+                size, pixel_offset, width, height, top_down, bpp = parse_bmp_header(f.read(BMP_HEADER_SIZE))
+                raw_size = file_size
+                record["format"] = "bmp"
+    except (OSError, ValueError) as e:
+        record["error"] = str(e)
+        return record
+
+    record.update(width=width, height=height, bpp=bpp, raw_size=raw_size,
+                  ratio=round(raw_size / file_size, 4) if file_size else None)
+    return record
+
+#Yield every BMP or .cmpt365 file under the given paths, directories walked recursively in sorted order
+def iter_catalog_paths(paths, extensions=CATALOG_EXTENSIONS):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(extensions):
+                    yield os.path.join(dirpath, name)
+
+#Header records of one batch of paths
+def _read_batch(paths):
+    return [read_header_record(path) for path in paths]
+
+#Group an iterable into lists of up to size items
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+#Yield the header record of every file under the given paths, reading them concurrently
+def iter_catalog(paths, workers=CATALOG_WORKERS, batch_size=CATALOG_BATCH):
+    batches = _batches(iter_catalog_paths(paths), batch_size)
+    if workers == 1:
+        for batch in batches:
+            yield from _read_batch(batch)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for records in iter_bounded_map(_read_batch, batches, executor, window=2 * workers):
+            yield from records
+
+#Write records to a text stream as CSV or a JSON array, one at a time; returns how many were written
+def write_catalog(records, out, fmt="csv"):
+    if fmt not in CATALOG_FORMATS:
+        raise ValueError(f"Unknown catalogue format: {fmt}")
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=CATALOG_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+        return count
+
+    out.write("[")
+    for record in records:
+        out.write(",\n" if count else "\n")
+        out.write(json.dumps(record))
+        count += 1
+    out.write("\n]\n" if count else "]\n")
+    return count
@@ -0,0 +1,224 @@
+"""Batch conversion between BMP and .cmpt365 files across a process pool
+
+    python -m cmpt365 compress photos/ -o archive/ -j 8
+    python -m cmpt365 compress scans/ --selection sampled
+    python -m cmpt365 compress screenshots/ --lzss-effort 3
+    python -m cmpt365 decompress archive/ -o restored/
+    python -m cmpt365 catalog archive/ -o catalog.json
+
+Directories are walked recursively. Outputs are written next to their inputs
+unless -o gives the root of a mirror tree, and outputs newer than their input
+are skipped unless --force is given. catalog only reads file headers and
+writes one CSV or JSON record per file to -o, or to stdout.
+"""
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+# Input and output extensions for each command
+COMMAND_EXTENSIONS = {
+    "compress": (".bmp", ".cmpt365"),
+    "decompress": (".cmpt365", ".bmp"),
+}
+
+#Worker task: compress one BMP with the best method, as (input size, output size, stage stats)
+def compress_file(src, dst, instrument=False, memory=False, selection="auto", lzss_effort=None):
+    from .codec import compress_bmp_file
+    from .lzss import LZSS_DEFAULT_EFFORT
+    if lzss_effort is None:
+        lzss_effort = LZSS_DEFAULT_EFFORT
+    
+    def write(path):
+        cmpt_data, method, sizes = compress_bmp_file(src, selection, lzss_effort)
+        with open(path, 'wb') as f:
+            return f.write(cmpt_data)
+    return _run_recorded(src, dst, write, instrument, memory)
+
+#Worker task: restore one .cmpt365 file as a BMP, as (input size, output size, stage stats)
+def decompress_file(src, dst, instrument=False, memory=False):
+    from .stream import decompress_stream
+    return _run_recorded(src, dst, lambda path: decompress_stream(src, path), instrument, memory)
+
+#Write one output, recording its stages when asked; stats travel back as a plain dict
+def _run_recorded(src, dst, write, instrument, memory):
+    if not instrument:
+        return os.path.getsize(src), write_atomic(dst, write), None
+    from .instrument import recording
+    with recording(memory=memory) as stats:
+        written = write_atomic(dst, write)
+    return os.path.getsize(src), written, stats.to_dict()
+
+#Produce a file under a temporary name so an interrupted run never leaves a complete-looking output
+def write_atomic(dst, write):
+    tmp_path = dst + ".tmp"
+    try:
+        written = write(tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return written
+
+#Yield (input path, output path) for every matching file under the given paths
+def find_jobs(paths, in_ext, out_ext, output_root=None):
+    for path in paths:
+        if os.path.isdir(path):
+            root = path
+            files = (os.path.join(dirpath, name)
+                     for dirpath, dirnames, filenames in os.walk(path)
+                     for name in sorted(filenames) if name.lower().endswith(in_ext))
+        else:
+            root = os.path.dirname(path)
+            files = [path]
+
+        for src in files:
+            base = os.path.splitext(src)[0] + out_ext
+            if output_root is None:
+                dst = base
+            else:
+                dst = os.path.join(output_root, os.path.relpath(base, root or "."))
+            yield src, dst
+
+#Outputs at least as new as their input need no work
+def is_up_to_date(src, dst):
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src)
+
+#Run a command over every job, returning (converted, skipped, failed, bytes in, bytes out, stage stats)
+def run_batch(task, jobs, workers=None, force=False, verbose=False):
+    pending = []
+    skipped = 0
+    for src, dst in jobs:
+        if not force and is_up_to_date(src, dst):
+            skipped += 1
+            continue
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        pending.append((src, dst))
+
+    converted = failed = bytes_in = bytes_out = 0
+    from .instrument import Stats
+    stage_stats = Stats()
+
+    if workers == 1 or len(pending) < 2:
+        from .codec import SerialExecutor
+        executor = SerialExecutor()
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    from concurrent.futures import as_completed
+    try:
+        futures = {executor.submit(task, src, dst): src for src, dst in pending}
+        for future in as_completed(futures):
+            src = futures[future]
+            try:
+                size_in, size_out, file_stats = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{src}: {e}", file=sys.stderr)
+                continue
+            converted += 1
+            bytes_in += size_in
+            bytes_out += size_out
+            if file_stats is not None:
+                stage_stats.extend(Stats.from_dict(file_stats))
+            if verbose:
+                print(f"{src}: {size_in:,} -> {size_out:,} bytes")
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return converted, skipped, failed, bytes_in, bytes_out, stage_stats
+
+#Write the header catalogue of every file under the given paths
+def run_catalog(args):
+    from .catalog import CATALOG_WORKERS, iter_catalog, write_catalog
+    fmt = args.format
+    if fmt is None:
+        fmt = "json" if args.output is not None and args.output.lower().endswith(".json") else "csv"
+
+    start_time = time.perf_counter()
+    failed = 0
+    def counted(records):
+        nonlocal failed
+        for record in records:
+            if record["error"] is not None:
+                failed += 1
+                print(f"{record['path']}: {record['error']}", file=sys.stderr)
+            yield record
+
+    records = counted(iter_catalog(args.paths, args.jobs or CATALOG_WORKERS))
+    if args.output is None:
+        count = write_catalog(records, sys.stdout, fmt)
+    else:
+        count = write_atomic(args.output, lambda path: _write_catalog_file(path, records, fmt))
+    elapsed = time.perf_counter() - start_time
+
+    # Keep stdout clean when the catalogue itself went there
+    report = sys.stderr if args.output is None else sys.stdout
+    rate = elapsed if elapsed > 0 else float("inf")
+    print(f"Catalogued {count} files ({failed} unreadable) in {elapsed:.2f} s, {count / rate:.0f} files/s", file=report)
+    return 1 if failed else 0
+
+def _write_catalog_file(path, records, fmt):
+    from .catalog import write_catalog
+    with open(path, 'w', newline="") as f:
+        return write_catalog(records, f, fmt)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cmpt365",
+                                     description="Convert or catalogue BMP and .cmpt365 files in bulk.")
+    parser.add_argument("command", choices=sorted(COMMAND_EXTENSIONS) + ["catalog"])
+    parser.add_argument("paths", nargs="+", help="files or directories to convert or catalogue")
+    parser.add_argument("-o", "--output", help="root of a mirror tree for the outputs (default: next to the inputs); "
+                                               "for catalog, the file to write (default: stdout)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes (default: one per CPU); for catalog, reader threads (default: 32)")
+    parser.add_argument("-f", "--force", action="store_true", help="convert files whose output is already up to date")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every converted file")
+    parser.add_argument("--selection", choices=("auto", "exact", "sampled"), default="auto",
+                        help="size every method exactly, or from a sample of rows (default: auto, "
+                             "sampling images of 64 MB or more)")
+    parser.add_argument("--lzss-effort", type=int, choices=range(4), default=None,
+                        help="hash-chain candidates the LZSS method tries, from 0 (previous byte, pixel and "
+                             "row only) to 3 (slowest, smallest; default: 1)")
+    parser.add_argument("--format", choices=("csv", "json"), default=None,
+                        help="catalog output format (default: json for a .json output, otherwise csv)")
+    parser.add_argument("--stats", action="store_true", help="print time spent in each pipeline stage")
+    parser.add_argument("--memory", action="store_true", help="with --stats, also trace peak memory per stage (slower)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.jobs is not None and args.jobs < 1:
+        build_parser().error("--jobs must be at least 1")
+    if args.command == "catalog":
+        return run_catalog(args)
+
+    in_ext, out_ext = COMMAND_EXTENSIONS[args.command]
+    if args.command == "compress":
+        task = partial(compress_file, selection=args.selection, lzss_effort=args.lzss_effort)
+    else:
+        task = decompress_file
+    if args.stats:
+        task = partial(task, instrument=True, memory=args.memory)
+
+    start_time = time.perf_counter()
+    jobs = find_jobs(args.paths, in_ext, out_ext, args.output)
+    converted, skipped, failed, bytes_in, bytes_out, stage_stats = run_batch(
+        task, jobs, args.jobs, args.force, args.verbose)
+    elapsed = time.perf_counter() - start_time
+
+    # Ratio is always uncompressed size over compressed size
+    if args.command == "compress":
+        ratio = bytes_in / bytes_out if bytes_out else 0.0
+    else:
+        ratio = bytes_out / bytes_in if bytes_in else 0.0
+    rate = elapsed if elapsed > 0 else float("inf")
+    print(f"{args.command.capitalize()}ed {converted} files ({skipped} up to date, {failed} failed) in {elapsed:.2f} s")
+    print(f"Throughput: {converted / rate:.1f} files/s, {bytes_in / rate / 1e6:.2f} MB/s in")
+    print(f"Compression ratio: {ratio:.4f} ({bytes_in:,} -> {bytes_out:,} bytes)")
+    if args.stats and len(stage_stats):
+        print("Stage totals across all files:")
+        print(stage_stats.summary())
+    return 1 if failed else 0
@@ -0,0 +1,616 @@
+"""Method selection, encoding and decoding of .cmpt365 payloads"""
+import functools
+import io
+
+import numpy as np
+
+from .bmp import BMPReader
+from .container import (BLOCK_CONTAINER_VERSION, BLOCK_INDEX_ENTRY_SIZE, BLOCK_INDEX_HEADER_SIZE,
+                        CMPT365_HEADER_SIZE, CODED_STREAM_HEADER_SIZE, FILTER_TABLE_HEADER_SIZE,
+                        LZSS_FIXED_DISTANCE_SIZE, LZSS_TABLE_HEADER_SIZE, PLANAR_SUBTRACT_GREEN,
+                        PLANAR_TABLE_HEADER_SIZE, block_ranges, build_cmpt365, default_rows_per_block, pack_block_index, pack_filter_table,
+                        pack_lzss_table, pack_planar_table, read_cmpt365_header, unpack_block_index,
+                        unpack_filter_table, unpack_lzss_table, unpack_planar_table)
+from .filters import filter_rows, filter_stride, unfilter_rows
+from .huffman import (canonical_huffman_compress, canonical_huffman_decompress, canonical_huffman_size,
+                      deserialize_code_lengths, deserialize_huffman_tree, huffman_decompress,
+                      iter_canonical_huffman_decompress, iter_huffman_decompress, serialize_code_lengths)
+from .instrument import stage
+from .lzss import (LZSS_DEFAULT_EFFORT, LZSS_MIN_MATCH, LZSS_WINDOW, lzss_cut_parse, lzss_fixed_distances,
+                   lzss_parse, lzss_rebuild, lzss_streams)
+from .planar import PLANE_NAMES, merge_planes, plane_histograms, split_planes
+from .rle import rle_compress, rle_decompress, rle_statistics
+
+# Payloads smaller than this are encoded inline; a process round trip costs more
+PARALLEL_MIN_BYTES = 1 << 18
+# Payloads at least this large size LZSS on a row sample first, and skip the full
+# parse when that puts it more than LZSS_SKIP_MARGIN above the best other method
+LZSS_SKIP_MIN_BYTES = 1 << 21
+LZSS_SKIP_MARGIN = 0.05
+
+_process_pool = None
+_thread_pool = None
+
+class SerialExecutor:
+    """Executor interface that runs every task immediately in the calling process"""
+    def submit(self, fn, *args, **kwargs):
+        from concurrent.futures import Future
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+#Shared worker pool, created on first use
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        if multiprocessing.parent_process() is not None:
+            # Already a pool worker (e.g. in a batch run): never nest another pool
+            _process_pool = SerialExecutor()
+        else:
+            # Spawned workers never inherit the GUI's Tk state
+            _process_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+#Shared thread pool for work that releases the GIL, such as coding the colour planes of one payload
+def get_thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _thread_pool = ThreadPoolExecutor(thread_name_prefix="cmpt365-codec")
+    return _thread_pool
+
+#Map over items in the thread pool when there is enough data for threads to pay off
+def _map_threads(task, items, total_bytes):
+    if total_bytes < PARALLEL_MIN_BYTES:
+        return list(map(task, items))
+    return list(get_thread_pool().map(task, items))
+
+#Undo the compression method applied to the pixel payload
+def decompress_payload(method, padding, table_bytes, payload):
+    if method == 0:  # Huffman only
+        return huffman_decompress(payload, deserialize_huffman_tree(table_bytes), padding)
+    elif method == 1:  # RLE + Huffman
+        return rle_decompress(huffman_decompress(payload, deserialize_huffman_tree(table_bytes), padding))
+    elif method == 2:  # RLE only
+        return rle_decompress(payload)
+    elif method == 3:  # Canonical Huffman only
+        return canonical_huffman_decompress(payload, deserialize_code_lengths(table_bytes), padding)
+    elif method == 4:  # RLE + Canonical Huffman
+        return rle_decompress(canonical_huffman_decompress(payload, deserialize_code_lengths(table_bytes), padding))
+    elif method == 5:  # Blocks, the padding byte holds the container version
+        if padding != BLOCK_CONTAINER_VERSION:
+            raise ValueError(f"Unsupported block container version: {padding}")
+        return decompress_blocks(table_bytes, payload)
+    elif method == 6:  # Row filters + Canonical Huffman
+        row_bytes, stride, code_lengths = unpack_filter_table(table_bytes)
+        filtered = canonical_huffman_decompress(payload, deserialize_code_lengths(code_lengths), padding)
+        return unfilter_rows(filtered, row_bytes, stride)
+    elif method == 7:  # Planar Canonical Huffman
+        return decode_planar(table_bytes, payload)
+    elif method == 8:  # LZSS + Canonical Huffman
+        return decode_lzss(table_bytes, payload)
+    raise ValueError(f"Unknown compression method: {method}")
+
+#Undo the compression method progressively, yielding decoded bytes as they become available
+def iter_decompress_payload(method, padding, table_bytes, payload):
+    """Huffman-only methods stream one decoder chunk at a time; the RLE
+    methods need their whole token stream, so they decode in one piece."""
+    if method == 0:
+        yield from iter_huffman_decompress(payload, deserialize_huffman_tree(table_bytes), padding)
+    elif method == 3:
+        yield from iter_canonical_huffman_decompress(payload, deserialize_code_lengths(table_bytes), padding)
+    else:
+        yield decompress_payload(method, padding, table_bytes, payload)
+
+#Worker task: canonical Huffman coding, as (padding, table_bytes, payload)
+def encode_canonical_huffman(data):
+    encoded, lengths, padding = canonical_huffman_compress(data)
+    return padding, serialize_code_lengths(lengths), encoded
+
+#Row filters then canonical Huffman coding, as (padding, table_bytes, payload)
+def encode_filtered(data, row_bytes, bpp, filtered=None):
+    stride = filter_stride(bpp)
+    if filtered is None:
+        filtered = filter_rows(data, row_bytes, stride)
+    padding, code_lengths, payload = encode_canonical_huffman(filtered)
+    return padding, pack_filter_table(row_bytes, stride, code_lengths), payload
+
+#Whether to subtract green and the method 7 table and payload sizes it gives, from plane histograms
+def planar_choice(data, row_bytes):
+    """Return (subtract_green, table size, payload size), preferring the plain split on ties"""
+    best = None
+    for subtract_green, histograms in plane_histograms(data, row_bytes).items():
+        table = PLANAR_TABLE_HEADER_SIZE
+        payload = 0
+        for frequencies in histograms:
+            table_size, payload_size = canonical_huffman_size(frequencies)
+            table += CODED_STREAM_HEADER_SIZE + table_size
+            payload += payload_size
+        if best is None or table + payload < best[1] + best[2]:
+            best = (subtract_green, table, payload)
+    return best
+
+#Worker task: canonical Huffman coding of one plane
+def _encode_plane(plane):
+    return encode_canonical_huffman(np.ascontiguousarray(plane))
+
+#Worker task: decode one (padding, code lengths, payload) stream
+def _decode_stream(stream):
+    padding, code_lengths, payload = stream
+    return canonical_huffman_decompress(payload, deserialize_code_lengths(code_lengths), padding)
+
+#Code the B, G, R and rest planes of a 24 bpp payload separately, as (padding, table_bytes, payload)
+def encode_planar(data, row_bytes):
+    """Planes are coded concurrently on the thread pool; B and R are coded as
+    differences from G whenever the histograms say that is smaller"""
+    with stage("planar_split", len(data)):
+        subtract_green = planar_choice(data, row_bytes)[0]
+        planes = split_planes(data, row_bytes, subtract_green)
+    coded = _map_threads(_encode_plane, planes, len(data))
+    
+    flags = PLANAR_SUBTRACT_GREEN if subtract_green else 0
+    table = pack_planar_table(row_bytes, flags, [(padding, code_lengths, len(payload))
+                                                 for padding, code_lengths, payload in coded])
+    return 0, table, b''.join(payload for _, _, payload in coded)
+
+#Decode a method 7 payload, one thread per plane
+def decode_planar(table_bytes, payload):
+    row_bytes, flags, plane_entries = unpack_planar_table(table_bytes, len(PLANE_NAMES))
+    planes = []
+    pos = 0
+    for padding, code_lengths, payload_len in plane_entries:
+        if pos + payload_len > len(payload):
+            raise ValueError("Plane payload is truncated")
+        planes.append((padding, code_lengths, payload[pos:pos + payload_len]))
+        pos += payload_len
+    decoded = _map_threads(_decode_stream, planes, len(payload))
+    with stage("planar_merge", len(payload)):
+        return merge_planes(decoded, row_bytes, bool(flags & PLANAR_SUBTRACT_GREEN))
+
+#Parse data into LZSS byte streams, as (fixed distances, parse, [literals, runs, lengths, distances], extra bits)
+def lzss_plan(data, row_bytes=None, bpp=None, effort=LZSS_DEFAULT_EFFORT, window=LZSS_WINDOW, parse=None):
+    """The previous row and pixel are always tried as match distances when
+    row_bytes and bpp are known. A parse of data, such as one cut from a
+    larger payload's parse, may be passed in to skip parsing."""
+    stride = filter_stride(bpp) if bpp else 1
+    fixed_distances = lzss_fixed_distances(row_bytes, stride, window)
+    if parse is None:
+        parse = lzss_parse(data, row_bytes, stride, effort, window)
+    streams, extra = lzss_streams(data, *parse, fixed_distances)
+    return fixed_distances, parse, streams, extra
+
+#LZSS plan of data[start:end], cut from the plan of the whole of data
+def lzss_cut_plan(data, plan, start, end):
+    fixed_distances, parse, _, _ = plan
+    cut = lzss_cut_parse(parse, start, end)
+    streams, extra = lzss_streams(data[start:end], *cut, fixed_distances)
+    return fixed_distances, cut, streams, extra
+
+#LZSS plan of data, or False when a row sample says LZSS cannot beat the other methods
+def lzss_candidate(data, row_bytes=None, bpp=None, effort=LZSS_DEFAULT_EFFORT, window=LZSS_WINDOW):
+    """Payloads under LZSS_SKIP_MIN_BYTES, or without whole rows, are always parsed"""
+    if len(data) >= LZSS_SKIP_MIN_BYTES and row_bytes and len(data) >= row_bytes:
+        view = memoryview(data)
+        sample = b''.join(view[start:end] for _, _, start, end in sample_ranges(len(view), row_bytes))
+        sizes = predict_sizes(sample, row_bytes=row_bytes, bpp=bpp, blocks=False,
+                              lzss=lzss_plan(sample, row_bytes, bpp, effort, window))
+        if sizes.pop(8) > min(sizes.values()) * (1 + LZSS_SKIP_MARGIN):
+            return False
+    return lzss_plan(data, row_bytes, bpp, effort, window)
+
+#Exact method 8 (table size, payload size) of an LZSS plan
+def lzss_size(plan):
+    fixed_distances, _, streams, extra = plan
+    table = LZSS_TABLE_HEADER_SIZE + LZSS_FIXED_DISTANCE_SIZE * len(fixed_distances)
+    payload = len(extra)
+    for stream in streams:
+        table_size, payload_size = canonical_huffman_size(
+            np.bincount(np.frombuffer(stream, dtype=np.uint8), minlength=256))
+        table += CODED_STREAM_HEADER_SIZE + table_size
+        payload += payload_size
+    return table, payload
+
+#LZSS parse, then canonical Huffman coding of each stream, as (padding, table_bytes, payload)
+def encode_lzss(data, row_bytes=None, bpp=None, plan=None, effort=LZSS_DEFAULT_EFFORT, window=LZSS_WINDOW):
+    fixed_distances, _, streams, extra = plan or lzss_plan(data, row_bytes, bpp, effort, window)
+    coded = _map_threads(encode_canonical_huffman, streams, len(data))
+    table = pack_lzss_table(LZSS_MIN_MATCH, len(extra), fixed_distances,
+                            [(padding, code_lengths, len(payload)) for padding, code_lengths, payload in coded])
+    return 0, table, b''.join(payload for _, _, payload in coded) + extra
+
+#Decode a method 8 payload
+def decode_lzss(table_bytes, payload):
+    min_match, extra_len, fixed_distances, stream_entries = unpack_lzss_table(table_bytes)
+    streams = []
+    pos = 0
+    for padding, code_lengths, payload_len in stream_entries:
+        if pos + payload_len > len(payload):
+            raise ValueError("LZSS stream payload is truncated")
+        streams.append((padding, code_lengths, payload[pos:pos + payload_len]))
+        pos += payload_len
+    if pos + extra_len > len(payload):
+        raise ValueError("LZSS extra bits are truncated")
+    decoded = _map_threads(_decode_stream, streams, len(payload))
+    with stage("lzss_rebuild", len(payload)) as s:
+        pixels = lzss_rebuild(*decoded, payload[pos:pos + extra_len], min_match, fixed_distances)
+        s.bytes_out = len(pixels)
+    return pixels
+
+# ============= SIZE PREDICTION =============
+
+#Exact (table size, payload size) of every single-payload method, from histograms and run boundaries only
+def predict_parts(pixel_data, row_bytes=None, bpp=None, filtered=None, lzss=None,
+                  lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    """Return {method: (table size, payload size)} without encoding anything.
+
+    Huffman sizes follow from the byte histogram and the code lengths it
+    yields; the RLE size and the histogram of the RLE output follow from
+    the run boundaries. With row_bytes and bpp the filtered method is sized
+    from the histogram of the filtered rows, which may be passed in when the
+    caller already has them. 24 bpp payloads also get the planar method,
+    sized from the histograms of its planes. LZSS is sized from the
+    histograms of its streams, which takes a full parse unless the caller
+    passes in an lzss_plan; lzss=False leaves it out, as lzss_candidate does
+    for large payloads a row sample rules it out for. The table size
+    covers everything a method stores besides its payload: code lengths,
+    stream headers and fixed distances.
+    """
+    with stage("histogram", len(pixel_data)):
+        frequencies = np.bincount(np.frombuffer(pixel_data, dtype=np.uint8), minlength=256)
+    rle_size, rle_histogram = rle_statistics(pixel_data)
+    
+    parts = {
+        3: canonical_huffman_size(frequencies),
+        4: canonical_huffman_size(rle_histogram),
+        2: (0, rle_size),
+    }
+    if row_bytes and bpp and len(pixel_data) >= row_bytes:
+        if filtered is None:
+            filtered = filter_rows(pixel_data, row_bytes, filter_stride(bpp))
+        with stage("histogram", len(filtered)):
+            filtered_frequencies = np.bincount(np.frombuffer(filtered, dtype=np.uint8), minlength=256)
+        filtered_table, filtered_payload = canonical_huffman_size(filtered_frequencies)
+        parts[6] = (FILTER_TABLE_HEADER_SIZE + filtered_table, filtered_payload)
+    if row_bytes and bpp == 24 and len(pixel_data) >= row_bytes:
+        parts[7] = planar_choice(pixel_data, row_bytes)[1:]
+    if lzss is None:
+        lzss = lzss_candidate(pixel_data, row_bytes, bpp, lzss_effort, lzss_window)
+    if lzss:
+        parts[8] = lzss_size(lzss)
+    return parts
+
+#Exact .cmpt365 size of every method, from histograms and run boundaries only
+def predict_sizes(pixel_data, color_table=bytes(), row_bytes=None, bpp=None, filtered=None, lzss=None,
+                  blocks=True, lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    """Return {method: file size} without encoding anything.
+
+    Single-payload methods are sized by predict_parts. With row_bytes,
+    payloads spanning several blocks also get a prediction for the block
+    container, which reuses the payload's filtered rows and LZSS parse, cut
+    at the block boundaries. blocks=False leaves the block container out.
+    """
+    fixed = CMPT365_HEADER_SIZE + len(color_table)
+    if row_bytes and bpp and filtered is None and len(pixel_data) >= row_bytes:
+        filtered = filter_rows(pixel_data, row_bytes, filter_stride(bpp))
+    if lzss is None:
+        lzss = lzss_candidate(pixel_data, row_bytes, bpp, lzss_effort, lzss_window)
+    
+    parts = predict_parts(pixel_data, row_bytes, bpp, filtered, lzss, lzss_effort, lzss_window)
+    sizes = {method: fixed + table + payload for method, (table, payload) in parts.items()}
+    if blocks and row_bytes and len(block_ranges(len(pixel_data), row_bytes)) > 1:
+        sizes[5] = fixed + predict_block_container_size(pixel_data, row_bytes, bpp=bpp, filtered=filtered,
+                                                        lzss=lzss, lzss_effort=lzss_effort, lzss_window=lzss_window)
+    return sizes
+
+#Encode data with a single method, as (padding, table_bytes, payload)
+def encode_method(method, data, row_bytes=None, bpp=None, lzss=None, lzss_effort=LZSS_DEFAULT_EFFORT,
+                  lzss_window=LZSS_WINDOW):
+    """lzss is the payload's lzss_plan when the caller already has one, or
+    False when LZSS was ruled out, which keeps it out of the blocks too"""
+    if method == 2:
+        return 0, bytes(), rle_compress(data)
+    elif method == 3:
+        return encode_canonical_huffman(data)
+    elif method == 4:
+        return encode_canonical_huffman(rle_compress(data))
+    elif method == 5:
+        index, payload = compress_blocks(data, row_bytes, bpp=bpp, lzss=lzss, lzss_effort=lzss_effort,
+                                         lzss_window=lzss_window)
+        return BLOCK_CONTAINER_VERSION, index, payload
+    elif method == 6:
+        return encode_filtered(data, row_bytes, bpp)
+    elif method == 7:
+        return encode_planar(data, row_bytes)
+    elif method == 8:
+        return encode_lzss(data, row_bytes, bpp, lzss or None, lzss_effort, lzss_window)
+    raise ValueError(f"Cannot encode with compression method: {method}")
+
+# ============= BLOCK CODING =============
+
+#Worker task: pick the smallest method for one block and encode it
+def compress_block(block, row_bytes=None, bpp=None, lzss_parse=None, lzss_effort=LZSS_DEFAULT_EFFORT,
+                   lzss_window=LZSS_WINDOW):
+    """With row_bytes and bpp, blocks of whole rows may also use the filtered
+    method. lzss_parse is the block's cut of the payload's LZSS parse, False
+    to leave LZSS out, or None to parse the block itself."""
+    filtered = None
+    if row_bytes and bpp and len(block) >= row_bytes:
+        filtered = filter_rows(block, row_bytes, filter_stride(bpp))
+    if lzss_parse is None:
+        lzss = lzss_candidate(block, row_bytes, bpp, lzss_effort, lzss_window)
+    else:
+        lzss = lzss_parse and lzss_plan(block, row_bytes, bpp, window=lzss_window, parse=lzss_parse)
+    sizes = predict_sizes(block, row_bytes=row_bytes, bpp=bpp, filtered=filtered, lzss=lzss)
+    sizes.pop(5, None)  # blocks never nest
+    method = min(sizes, key=sizes.get)
+    if method == 6:
+        return (method,) + encode_filtered(block, row_bytes, bpp, filtered)
+    elif method == 8:
+        return (method,) + encode_lzss(block, plan=lzss)
+    return (method,) + encode_method(method, block, row_bytes, bpp)
+
+#Worker task: compress_block on a (block, lzss_parse) pair
+def _compress_block_item(item, **kwargs):
+    block, lzss_parse = item
+    return compress_block(block, lzss_parse=lzss_parse, **kwargs)
+
+#Worker task: decode one (method, padding, table_bytes, payload) block
+def decompress_block(block):
+    return decompress_payload(*block)
+
+#Map a worker task over blocks, in the process pool when there is enough work
+def _map_blocks(task, blocks, total_bytes, executor=None):
+    if executor is None and (len(blocks) < 2 or total_bytes < PARALLEL_MIN_BYTES):
+        return list(map(task, blocks))
+    return list((executor or get_process_pool()).map(task, blocks))
+
+#Filtered rows of one block, cut from the filtered rows of the whole payload
+def _block_filtered_rows(view, filtered, start, end, row_bytes, stride):
+    """Blocks restart filtering with a blank row above, so only their first
+    row differs from the whole-payload filtering and is filtered again"""
+    first_row = filter_rows(view[start:start + row_bytes], row_bytes, stride)
+    rows_start = (start // row_bytes + 1) * (row_bytes + 1)
+    whole_rows = len(view) // row_bytes
+    if end >= whole_rows * row_bytes:
+        # The last block also carries the unfiltered bytes after the rows
+        return first_row + bytes(filtered[rows_start:])
+    return first_row + bytes(filtered[rows_start:end // row_bytes * (row_bytes + 1)])
+
+#Exact size of the block index plus every block's table and payload
+def predict_block_container_size(pixel_data, row_bytes, rows_per_block=None, bpp=None, filtered=None, lzss=None,
+                                 lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    """Blocks are sized as compress_block codes them; the filtered method is
+    considered when bpp is given, reusing the filtered rows of the whole
+    payload. LZSS blocks are cut from the payload's lzss_plan, when given,
+    and left out when lzss is False."""
+    ranges = block_ranges(len(pixel_data), row_bytes, rows_per_block)
+    size = BLOCK_INDEX_HEADER_SIZE + BLOCK_INDEX_ENTRY_SIZE * len(ranges)
+    view = memoryview(pixel_data)
+    if bpp and filtered is None and len(view) >= row_bytes:
+        filtered = filter_rows(view, row_bytes, filter_stride(bpp))
+    for start, end in ranges:
+        block_filtered = None
+        if bpp and end - start >= row_bytes:
+            block_filtered = _block_filtered_rows(view, filtered, start, end, row_bytes, filter_stride(bpp))
+        block_lzss = lzss and lzss_cut_plan(view, lzss, start, end)
+        block_sizes = predict_sizes(view[start:end], row_bytes=row_bytes, bpp=bpp, filtered=block_filtered,
+                                    lzss=block_lzss, lzss_effort=lzss_effort, lzss_window=lzss_window)
+        size += min(block_sizes.values()) - CMPT365_HEADER_SIZE
+    return size
+
+#Split the payload into row blocks and code each with its best method
+def compress_blocks(pixel_data, row_bytes, rows_per_block=None, executor=None, bpp=None, lzss=None,
+                    lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    """Return (index_bytes, payload) for the block container. With the
+    payload's lzss_plan, blocks code LZSS from their cut of its parse;
+    without one each block parses itself, and lzss=False leaves LZSS out."""
+    rows_per_block = rows_per_block or default_rows_per_block(row_bytes)
+    view = memoryview(pixel_data)
+    ranges = block_ranges(len(view), row_bytes, rows_per_block)
+    blocks = [bytes(view[start:end]) for start, end in ranges]
+    if lzss:
+        parses = [lzss_cut_parse(lzss[1], start, end) for start, end in ranges]
+    else:
+        parses = [lzss] * len(ranges)
+    task = functools.partial(_compress_block_item, row_bytes=row_bytes, bpp=bpp, lzss_effort=lzss_effort,
+                             lzss_window=lzss_window)
+    coded = _map_blocks(task, list(zip(blocks, parses)), len(view), executor)
+    
+    entries = []
+    payload = bytearray()
+    for method, padding, table_bytes, block_payload in coded:
+        entries.append((method, padding, len(table_bytes), len(block_payload), len(payload)))
+        payload.extend(table_bytes)
+        payload.extend(block_payload)
+    return pack_block_index(rows_per_block, entries), bytes(payload)
+
+#Parse the block index into (method, padding, table_bytes, payload) tuples
+def parse_block_index(index_bytes, payload):
+    blocks = []
+    for method, padding, table_len, payload_len, offset in unpack_block_index(index_bytes):
+        table_bytes = bytes(payload[offset:offset + table_len])
+        block_payload = bytes(payload[offset + table_len:offset + table_len + payload_len])
+        blocks.append((method, padding, table_bytes, block_payload))
+    return blocks
+
+#Decode every block, in parallel when there is enough work
+def decompress_blocks(index_bytes, payload, executor=None):
+    blocks = parse_block_index(index_bytes, payload)
+    return b''.join(_map_blocks(decompress_block, blocks, len(payload), executor))
+
+# ============= SAMPLED SELECTION =============
+
+# Payloads at least this large pick their method from a sample of rows by default
+SAMPLE_AUTO_BYTES = 1 << 26
+# Smallest sample; payloads it would mostly cover are sized exactly instead
+SAMPLE_MIN_BYTES = 1 << 20
+# Share of the rows in the first sample, taken as equal runs of rows from up to this many even bands
+SAMPLE_FRACTION = 1 / 16
+SAMPLE_STRATA = 32
+# Fewest consecutive rows sampled from a band, so filters and matches still see the rows above
+SAMPLE_BAND_ROWS = 16
+# When the two best estimates are closer than this share, the sample grows by
+# SAMPLE_GROWTH, up to SAMPLE_MAX_FRACTION of the rows
+SAMPLE_MARGIN = 0.02
+SAMPLE_GROWTH = 4
+SAMPLE_MAX_FRACTION = 1 / 4
+
+#Byte ranges of a stratified row sample: a centred run of rows from each of `strata` even bands
+def sample_ranges(length, row_bytes, fraction=SAMPLE_FRACTION, strata=SAMPLE_STRATA):
+    """Return [(band_start, band_end, sample_start, sample_end)] in bytes,
+    with whole rows only; bytes after the last row belong to the last band"""
+    rows = length // row_bytes
+    sampled_rows = max(1, round(rows * fraction))
+    strata = max(1, min(strata, sampled_rows // SAMPLE_BAND_ROWS))
+    take = max(1, sampled_rows // strata)
+    ranges = []
+    for band in range(strata):
+        first, last = band * rows // strata, (band + 1) * rows // strata
+        start = first + max(0, (last - first - take) // 2)
+        end = min(last, start + take)
+        band_end = length if band == strata - 1 else last * row_bytes
+        ranges.append((first * row_bytes, band_end, start * row_bytes, end * row_bytes))
+    return ranges
+
+#Estimated .cmpt365 size of every method from a stratified sample of rows
+def estimate_sizes(pixel_data, color_table=bytes(), row_bytes=None, bpp=None, fraction=SAMPLE_FRACTION,
+                   lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    """Return {method: estimated file size}.
+
+    The sampled rows are sized with predict_parts, which measures exactly
+    what each method codes (byte histograms, run statistics, filter
+    residuals, LZSS streams). Only the payload part scales with the share
+    of the data sampled; a method's table is stored once however much data
+    it codes, so it is added back as measured. The block container is
+    estimated band by band from each band's best method, like
+    compress_block picks them, with one table per block in the band.
+    """
+    view = memoryview(pixel_data)
+    fixed = CMPT365_HEADER_SIZE + len(color_table)
+    ranges = sample_ranges(len(view), row_bytes, fraction)
+    with stage("sample", len(view)) as s:
+        bands = [bytes(view[start:end]) for _, _, start, end in ranges]
+        sample = b''.join(bands)
+        s.bytes_out = len(sample)
+    scale = len(view) / len(sample)
+    
+    sampled = predict_parts(sample, row_bytes, bpp, lzss_effort=lzss_effort, lzss_window=lzss_window)
+    sizes = {method: fixed + table + round(payload * scale) for method, (table, payload) in sampled.items()}
+    
+    blocks = block_ranges(len(view), row_bytes)
+    if len(blocks) > 1:
+        block_bytes = blocks[0][1] - blocks[0][0]
+        size = BLOCK_INDEX_HEADER_SIZE + BLOCK_INDEX_ENTRY_SIZE * len(blocks)
+        for (band_start, band_end, _, _), band in zip(ranges, bands):
+            band_parts = predict_parts(band, row_bytes, bpp, lzss_effort=lzss_effort, lzss_window=lzss_window)
+            band_blocks = (band_end - band_start) / block_bytes
+            band_scale = (band_end - band_start) / len(band)
+            size += min(table * band_blocks + payload * band_scale for table, payload in band_parts.values())
+        sizes[5] = fixed + round(size)
+    return sizes
+
+#Pick a method from growing row samples, as (method, {method: size}, share of the rows sampled)
+def select_method_sampled(pixel_data, color_table=bytes(), row_bytes=None, bpp=None,
+                          fraction=SAMPLE_FRACTION, margin=SAMPLE_MARGIN, lzss_effort=LZSS_DEFAULT_EFFORT,
+                          lzss_window=LZSS_WINDOW, min_bytes=SAMPLE_MIN_BYTES):
+    """The sample grows while the runner-up is within margin of the best
+    estimate, until the largest sample settles it; methods still that close
+    cost about the same. Payloads too small for a min_bytes sample to save
+    work are sized exactly. A larger fraction or margin trades selection
+    time for accuracy."""
+    if not row_bytes or len(pixel_data) < row_bytes:
+        raise ValueError("Sampled selection needs whole rows")
+    fraction = max(fraction, min_bytes / len(pixel_data))
+    if fraction > SAMPLE_MAX_FRACTION:
+        method, sizes = select_method(pixel_data, color_table, row_bytes, bpp, lzss_effort=lzss_effort,
+                                      lzss_window=lzss_window)
+        return method, sizes, 1.0
+    while True:
+        sizes = estimate_sizes(pixel_data, color_table, row_bytes, bpp, fraction, lzss_effort, lzss_window)
+        best, runner_up = sorted(sizes.values())[:2]
+        if runner_up - best > margin * best or fraction * SAMPLE_GROWTH > SAMPLE_MAX_FRACTION:
+            return min(sizes, key=sizes.get), sizes, fraction
+        fraction *= SAMPLE_GROWTH
+
+# ============= HIGH-LEVEL API =============
+
+# How compress_pixels picks its method
+SELECTION_MODES = ("auto", "exact", "sampled")
+
+#Pick the smallest method for a pixel payload, as (method, {method: predicted size})
+def select_method(pixel_data, color_table=bytes(), row_bytes=None, bpp=None, lzss=None,
+                  lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    sizes = predict_sizes(pixel_data, color_table, row_bytes, bpp, lzss=lzss, lzss_effort=lzss_effort,
+                          lzss_window=lzss_window)
+    return min(sizes, key=sizes.get), sizes
+
+#Compress a stored BMP pixel payload into a .cmpt365 file
+def compress_pixels(pixel_data, width, height, bpp, color_table=bytes(), row_bytes=None, selection="auto",
+                    lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    """Return (cmpt365 bytes, method, {method: predicted size}).
+
+    With selection "exact" every method is sized exactly; "sampled" sizes
+    them from a sample of rows, so the sizes are estimates, and "auto"
+    samples payloads of SAMPLE_AUTO_BYTES or more. Either way only the
+    chosen method is encoded, and an exact selection's LZSS parse is reused
+    to encode it. lzss_effort and lzss_window are passed on to lzss_parse.
+    """
+    if selection not in SELECTION_MODES:
+        raise ValueError(f"Unknown method selection: {selection}")
+    sampled = selection == "sampled" or (selection == "auto" and len(pixel_data) >= SAMPLE_AUTO_BYTES)
+    lzss = None
+    with stage("select", len(pixel_data)):
+        if sampled and row_bytes and len(pixel_data) >= row_bytes:
+            method, sizes, _ = select_method_sampled(pixel_data, color_table, row_bytes, bpp,
+                                                     lzss_effort=lzss_effort, lzss_window=lzss_window)
+        else:
+            lzss = lzss_candidate(pixel_data, row_bytes, bpp, lzss_effort, lzss_window)
+            method, sizes = select_method(pixel_data, color_table, row_bytes, bpp, lzss)
+    with stage("encode", len(pixel_data)) as s:
+        padding, table_bytes, payload = encode_method(method, pixel_data, row_bytes, bpp, lzss, lzss_effort,
+                                                      lzss_window)
+        s.bytes_out = len(table_bytes) + len(payload)
+    with stage("container", len(payload)) as s:
+        cmpt_data = bytes(build_cmpt365(width, height, bpp, method, padding, color_table, table_bytes, payload))
+        s.bytes_out = len(cmpt_data)
+    return cmpt_data, method, sizes
+
+#Compress the BMP file at path with the best method, as compress_pixels does
+def compress_bmp_file(path, selection="auto", lzss_effort=LZSS_DEFAULT_EFFORT, lzss_window=LZSS_WINDOW):
+    with stage("read") as s:
+        reader = BMPReader(path)
+        s.bytes_out = reader.size
+    with reader:
+        pixel_data = reader.bottom_up_pixel_bytes()
+        result = compress_pixels(pixel_data, reader.width, reader.height, reader.bpp,
+                                 reader.color_table, reader.row_bytes, selection, lzss_effort, lzss_window)
+        pixel_data.release()
+    return result
+
+#Decompress a .cmpt365 file held in memory
+def decompress_cmpt365(data):
+    """Return (width, height, bpp, method, color_table, stored pixel payload)"""
+    with stage("parse", len(data)):
+        width, height, bpp, method, padding, color_table_len, table_len = read_cmpt365_header(
+            io.BytesIO(data[:CMPT365_HEADER_SIZE]))
+        view = memoryview(data)
+        pos = CMPT365_HEADER_SIZE
+        color_table = bytes(view[pos:pos + color_table_len])
+        pos += color_table_len
+        table_bytes = bytes(view[pos:pos + table_len])
+        pos += table_len
+    with stage("decode", len(view) - pos) as s:
+        pixels = decompress_payload(method, padding, table_bytes, view[pos:])
+        s.bytes_out = len(pixels)
+    return width, height, bpp, method, color_table, pixels
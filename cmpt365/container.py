@@ -0,0 +1,214 @@
+"""The .cmpt365 file format: header, method ids and the block index"""
+
+# Compression method ids stored in the .cmpt365 header
+COMPRESSION_METHODS = {
+    0: "Huffman",                # serialized tree
+    1: "RLE+Huffman",            # serialized tree
+    2: "RLE only",
+    3: "Canonical Huffman",      # code length table
+    4: "RLE+Canonical Huffman",  # code length table
+    5: "Blocks",                 # v2 container of independently coded blocks
+    6: "Filtered+Canonical Huffman",  # filter parameters + code length table
+    7: "Planar Canonical Huffman",    # per-plane code length tables
+    8: "LZSS+Canonical Huffman",      # sequence counts + per-stream code length tables
+}
+
+# Fixed .cmpt365 header: signature, width, height, bpp, method, padding, two lengths
+CMPT365_HEADER_SIZE = 27
+
+#Build a .cmpt365 file from its header fields and sections
+def build_cmpt365(width, height, bpp, method, padding, color_table, table_bytes, payload):
+    cmpt_data = bytearray()
+    cmpt_data.extend(b'CMPT365')  # 7 bytes signature
+    cmpt_data.extend(width.to_bytes(4, 'little'))
+    cmpt_data.extend(height.to_bytes(4, 'little'))
+    cmpt_data.extend(bpp.to_bytes(2, 'little'))
+    cmpt_data.extend(method.to_bytes(1, 'little'))
+    cmpt_data.extend(padding.to_bytes(1, 'little'))
+    cmpt_data.extend(len(color_table).to_bytes(4, 'little'))
+    cmpt_data.extend(len(table_bytes).to_bytes(4, 'little'))  # Huffman tree or code lengths
+    cmpt_data.extend(color_table)
+    cmpt_data.extend(table_bytes)
+    cmpt_data.extend(payload)
+    return cmpt_data
+
+#Read the fixed .cmpt365 header from an open file
+def read_cmpt365_header(f):
+    """Return (width, height, bpp, method, padding, color_table_len, table_len)"""
+    header = f.read(CMPT365_HEADER_SIZE)
+    if len(header) < CMPT365_HEADER_SIZE or header[:7] != b'CMPT365':
+        raise ValueError("Invalid .cmpt365 file")
+    
+    width = int.from_bytes(header[7:11], 'little')
+    height = int.from_bytes(header[11:15], 'little')
+    bpp = int.from_bytes(header[15:17], 'little')
+    method = header[17]
+    padding = header[18]
+    color_table_len = int.from_bytes(header[19:23], 'little')
+    table_len = int.from_bytes(header[23:27], 'little')
+    if method not in COMPRESSION_METHODS:
+        raise ValueError(f"Unknown compression method: {method}")
+    return width, height, bpp, method, padding, color_table_len, table_len
+
+#Size of the .cmpt365 file a candidate would produce
+def cmpt365_size(color_table, table_bytes, payload):
+    return CMPT365_HEADER_SIZE + len(color_table) + len(table_bytes) + len(payload)
+
+# ============= BLOCK CONTAINER (.cmpt365 v2) =============
+
+# Method 5 files keep the usual header; the padding byte holds this version,
+# and the table section holds the block index:
+#   rows per block (4), block count (4), then per block
+#   method (1), padding (1), table length (4), payload length (4), offset (8)
+# Each block's table and payload sit at its offset in the payload section.
+BLOCK_CONTAINER_VERSION = 2
+BLOCK_INDEX_HEADER_SIZE = 8
+BLOCK_INDEX_ENTRY_SIZE = 18
+# Rows per block are chosen so blocks hold about this many bytes
+BLOCK_TARGET_BYTES = 1 << 20
+
+#Rows per block for a given row size
+def default_rows_per_block(row_bytes):
+    return max(1, BLOCK_TARGET_BYTES // max(1, row_bytes))
+
+#Byte ranges of the blocks; the last block also takes any bytes after the rows
+def block_ranges(length, row_bytes, rows_per_block=None):
+    block_bytes = (rows_per_block or default_rows_per_block(row_bytes)) * row_bytes
+    starts = list(range(0, length, block_bytes))
+    return [(start, min(start + block_bytes, length)) for start in starts]
+
+#Block index bytes from (method, padding, table length, payload length, offset) entries
+def pack_block_index(rows_per_block, entries):
+    index = bytearray()
+    index.extend(rows_per_block.to_bytes(4, 'little'))
+    index.extend(len(entries).to_bytes(4, 'little'))
+    for method, padding, table_len, payload_len, offset in entries:
+        index.extend(method.to_bytes(1, 'little'))
+        index.extend(padding.to_bytes(1, 'little'))
+        index.extend(table_len.to_bytes(4, 'little'))
+        index.extend(payload_len.to_bytes(4, 'little'))
+        index.extend(offset.to_bytes(8, 'little'))
+    return bytes(index)
+
+#Parse the block index back into its entries
+def unpack_block_index(index_bytes):
+    block_count = int.from_bytes(index_bytes[4:8], 'little')
+    if len(index_bytes) < BLOCK_INDEX_HEADER_SIZE + BLOCK_INDEX_ENTRY_SIZE * block_count:
+        raise ValueError("Block index is truncated")
+    
+    entries = []
+    pos = BLOCK_INDEX_HEADER_SIZE
+    for _ in range(block_count):
+        method = index_bytes[pos]
+        padding = index_bytes[pos + 1]
+        table_len = int.from_bytes(index_bytes[pos + 2:pos + 6], 'little')
+        payload_len = int.from_bytes(index_bytes[pos + 6:pos + 10], 'little')
+        offset = int.from_bytes(index_bytes[pos + 10:pos + 18], 'little')
+        pos += BLOCK_INDEX_ENTRY_SIZE
+        entries.append((method, padding, table_len, payload_len, offset))
+    return entries
+
+# ============= FILTERED METHOD =============
+
+# Method 6 tables start with the row size (4) and filter stride (1) the
+# rows were filtered with, followed by the code lengths of the filtered stream
+FILTER_TABLE_HEADER_SIZE = 5
+
+#Method 6 table bytes from the filter parameters and serialized code lengths
+def pack_filter_table(row_bytes, stride, code_lengths):
+    return row_bytes.to_bytes(4, 'little') + stride.to_bytes(1, 'little') + code_lengths
+
+#Split a method 6 table into (row_bytes, stride, serialized code lengths)
+def unpack_filter_table(table_bytes):
+    if len(table_bytes) < FILTER_TABLE_HEADER_SIZE:
+        raise ValueError("Filter table is truncated")
+    row_bytes = int.from_bytes(table_bytes[0:4], 'little')
+    stride = table_bytes[4]
+    if row_bytes == 0 or stride == 0:
+        raise ValueError("Invalid filter parameters")
+    return row_bytes, stride, bytes(table_bytes[FILTER_TABLE_HEADER_SIZE:])
+
+# ============= CODED STREAMS =============
+
+# Methods that code several byte streams separately describe each with its
+# padding (1), code length table length (4), payload length (8) and the code
+# lengths; the payload holds the stream payloads in the same order
+CODED_STREAM_HEADER_SIZE = 13
+
+#Append the (padding, code lengths, payload length) entry of every stream to table
+def _pack_streams(table, streams):
+    for padding, code_lengths, payload_len in streams:
+        table.extend(padding.to_bytes(1, 'little'))
+        table.extend(len(code_lengths).to_bytes(4, 'little'))
+        table.extend(payload_len.to_bytes(8, 'little'))
+        table.extend(code_lengths)
+    return bytes(table)
+
+#Parse count stream entries starting at pos, as [(padding, code lengths, payload length)]
+def _unpack_streams(table_bytes, pos, count, name):
+    streams = []
+    for _ in range(count):
+        if len(table_bytes) < pos + CODED_STREAM_HEADER_SIZE:
+            raise ValueError(f"{name} table is truncated")
+        padding = table_bytes[pos]
+        lengths_len = int.from_bytes(table_bytes[pos + 1:pos + 5], 'little')
+        payload_len = int.from_bytes(table_bytes[pos + 5:pos + 13], 'little')
+        pos += CODED_STREAM_HEADER_SIZE
+        streams.append((padding, bytes(table_bytes[pos:pos + lengths_len]), payload_len))
+        pos += lengths_len
+    return streams
+
+# ============= PLANAR METHOD =============
+
+# Method 7 tables: row size (4) and flags (1), then a coded stream entry for
+# each of the B, G, R and rest planes
+PLANAR_TABLE_HEADER_SIZE = 5
+# Flag set when B and R were coded as B-G and R-G
+PLANAR_SUBTRACT_GREEN = 1
+
+#Method 7 table bytes from the row size, flags and (padding, code lengths, payload length) per plane
+def pack_planar_table(row_bytes, flags, planes):
+    table = bytearray()
+    table.extend(row_bytes.to_bytes(4, 'little'))
+    table.extend(flags.to_bytes(1, 'little'))
+    return _pack_streams(table, planes)
+
+#Parse a method 7 table into (row_bytes, flags, [(padding, code lengths, payload length)])
+def unpack_planar_table(table_bytes, plane_count=4):
+    if len(table_bytes) < PLANAR_TABLE_HEADER_SIZE:
+        raise ValueError("Planar table is truncated")
+    row_bytes = int.from_bytes(table_bytes[0:4], 'little')
+    flags = table_bytes[4]
+    return row_bytes, flags, _unpack_streams(table_bytes, PLANAR_TABLE_HEADER_SIZE, plane_count, "Planar")
+
+# ============= LZSS METHOD =============
+
+# Method 8 tables: minimum match length (1), extra bits payload length (8)
+# and the number of fixed distances (1), then each fixed distance (4) and a
+# coded stream entry for each of the literal, run length, match length and
+# distance streams. The extra bits follow the stream payloads.
+LZSS_TABLE_HEADER_SIZE = 10
+LZSS_FIXED_DISTANCE_SIZE = 4
+
+#Method 8 table bytes from the minimum match, extra bits length, fixed distances and four stream entries
+def pack_lzss_table(min_match, extra_len, fixed_distances, streams):
+    table = bytearray()
+    table.extend(min_match.to_bytes(1, 'little'))
+    table.extend(extra_len.to_bytes(8, 'little'))
+    table.extend(len(fixed_distances).to_bytes(1, 'little'))
+    for distance in fixed_distances:
+        table.extend(distance.to_bytes(LZSS_FIXED_DISTANCE_SIZE, 'little'))
+    return _pack_streams(table, streams)
+
+#Parse a method 8 table into (min_match, extra bits length, fixed distances, [(padding, code lengths, payload length)])
+def unpack_lzss_table(table_bytes, stream_count=4):
+    if len(table_bytes) < LZSS_TABLE_HEADER_SIZE:
+        raise ValueError("LZSS table is truncated")
+    min_match = table_bytes[0]
+    extra_len = int.from_bytes(table_bytes[1:9], 'little')
+    pos = LZSS_TABLE_HEADER_SIZE + LZSS_FIXED_DISTANCE_SIZE * table_bytes[9]
+    if len(table_bytes) < pos:
+        raise ValueError("LZSS table is truncated")
+    fixed_distances = tuple(int.from_bytes(table_bytes[p:p + LZSS_FIXED_DISTANCE_SIZE], 'little')
+                            for p in range(LZSS_TABLE_HEADER_SIZE, pos, LZSS_FIXED_DISTANCE_SIZE))
+    return min_match, extra_len, fixed_distances, _unpack_streams(table_bytes, pos, stream_count, "LZSS")
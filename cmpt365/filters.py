@@ -0,0 +1,145 @@
+"""PNG-style row filters (None, Sub, Up, Average, Paeth) over stored BMP rows
+
+Filters are byte-wise as in PNG: each byte is predicted from the byte one
+pixel to its left (a), the byte above it (b) and the byte above-left (c),
+with `stride` bytes per pixel. The filtered stream holds, for every row, a
+filter type byte followed by row_bytes residuals; bytes after the last whole
+row are appended unfiltered.
+"""
+import numpy as np
+
+from .instrument import timed_stage
+
+FILTER_TYPES = ("None", "Sub", "Up", "Average", "Paeth")
+
+# Input bytes filtered per vectorized pass; every pass holds five candidate rows per row
+FILTER_CHUNK_BYTES = 1 << 21
+# Bytes of the skewed work arrays used to undo Average and Paeth rows
+UNFILTER_BAND_BYTES = 1 << 26
+
+#Bytes per pixel the filters step over: whole bytes per pixel, or 1 below 8 bpp as in PNG
+def filter_stride(bpp):
+    return max(1, bpp // 8)
+
+#Paeth predictor of uint8 arrays, chosen with the same tie order as PNG
+def paeth_predictor(a, b, c):
+    a16, b16, c16 = a.astype(np.int16), b.astype(np.int16), c.astype(np.int16)
+    pa = np.abs(b16 - c16)
+    pb = np.abs(a16 - c16)
+    pc = np.abs(a16 + b16 - 2 * c16)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+#Floor of the mean of two uint8 arrays
+def average_predictor(a, b):
+    return ((a.astype(np.uint16) + b) >> 1).astype(np.uint8)
+
+#Filter every whole row with the type that minimizes its sum of absolute residuals
+@timed_stage("filter")
+def filter_rows(data, row_bytes, stride):
+    view = np.frombuffer(data, dtype=np.uint8)
+    rows = len(view) // row_bytes
+    out = np.empty((rows, row_bytes + 1), dtype=np.uint8)
+    prev = np.zeros(row_bytes, dtype=np.uint8)
+    chunk_rows = max(1, FILTER_CHUNK_BYTES // row_bytes)
+
+    for start in range(0, rows, chunk_rows):
+        x = view[start * row_bytes:min(start + chunk_rows, rows) * row_bytes].reshape(-1, row_bytes)
+        b = np.concatenate([prev[None], x[:-1]])
+        a = np.zeros_like(x)
+        a[:, stride:] = x[:, :-stride]
+        c = np.zeros_like(x)
+        c[:, stride:] = b[:, :-stride]
+
+        # Residuals wrap modulo 256, like PNG
+        candidates = np.stack([x, x - a, x - b, x - average_predictor(a, b), x - paeth_predictor(a, b, c)])
+        scores = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2, dtype=np.int64)
+        best = scores.argmin(axis=0)
+
+        out[start:start + len(x), 0] = best
+        out[start:start + len(x), 1:] = np.take_along_axis(candidates, best[None, :, None], axis=0)[0]
+        prev = x[-1]
+    return out.tobytes() + bytes(view[rows * row_bytes:])
+
+#Undo the filters one row at a time when no row depends on its own reconstructed bytes
+def _unfilter_rowwise(types, residuals, stride):
+    out = np.empty_like(residuals)
+    prev = np.zeros(residuals.shape[1], dtype=np.uint8)
+    padded_bytes = -(-residuals.shape[1] // stride) * stride
+    for y, (filter_type, residual) in enumerate(zip(types.tolist(), residuals)):
+        if filter_type == 0:
+            out[y] = residual
+        elif filter_type == 1:
+            # Sub is a running sum along each of the stride byte lanes
+            lanes = np.zeros(padded_bytes, dtype=np.uint8)
+            lanes[:len(residual)] = residual
+            out[y] = np.cumsum(lanes.reshape(-1, stride), axis=0, dtype=np.uint8).reshape(-1)[:len(residual)]
+        else:  # Up
+            out[y] = residual + prev
+        prev = out[y]
+    return out
+
+#Undo any mix of filters over a band of rows, one anti-diagonal of pixels at a time
+def _unfilter_wavefront(types, residuals, prev, stride):
+    """Each pixel depends only on its left, upper and upper-left neighbours, so
+    every pixel on an anti-diagonal can be reconstructed at once. The band is
+    skewed so that diagonal k is the contiguous slab skewed[k + 2]; slot 0 of
+    each diagonal holds the row above the band."""
+    rows = len(types)
+    cols = prev.shape[0]
+    diagonals = rows + cols - 1
+    pixels = np.zeros((rows, cols * stride), dtype=np.uint8)
+    pixels[:, :residuals.shape[1]] = residuals
+    pixels = pixels.reshape(rows, cols, stride)
+
+    skewed_residuals = np.zeros((diagonals, rows + 1, stride), dtype=np.uint8)
+    for y in range(rows):
+        skewed_residuals[y:y + cols, y + 1] = pixels[y]
+    skewed = np.zeros((diagonals + 2, rows + 1, stride), dtype=np.uint8)
+    skewed[1:cols + 1, 0] = prev
+
+    row_types = types.reshape(-1, 1)
+    zero = np.zeros((rows, stride), dtype=np.uint8)
+    has_average = bool((types == 3).any())
+    has_paeth = bool((types == 4).any())
+    for k in range(diagonals):
+        lo, hi = max(0, k - cols + 1) + 1, min(rows - 1, k) + 2
+        a = skewed[k + 1, lo:hi]
+        b = skewed[k + 1, lo - 1:hi - 1]
+        c = skewed[k, lo - 1:hi - 1]
+        n = hi - lo
+        predictions = (zero[:n], a, b,
+                       average_predictor(a, b) if has_average else zero[:n],
+                       paeth_predictor(a, b, c) if has_paeth else zero[:n])
+        skewed[k + 2, lo:hi] = skewed_residuals[k, lo:hi] + np.choose(row_types[lo - 1:hi - 1], predictions)
+
+    for y in range(rows):
+        pixels[y] = skewed[y + 2:y + 2 + cols, y + 1]
+    return pixels.reshape(rows, -1)[:, :residuals.shape[1]]
+
+#Invert filter_rows
+@timed_stage("unfilter")
+def unfilter_rows(filtered, row_bytes, stride):
+    view = np.frombuffer(filtered, dtype=np.uint8)
+    rows = len(view) // (row_bytes + 1)
+    body = view[:rows * (row_bytes + 1)].reshape(rows, row_bytes + 1)
+    types, residuals = body[:, 0], body[:, 1:]
+    if rows and types.max() >= len(FILTER_TYPES):
+        raise ValueError(f"Unknown row filter: {int(types.max())}")
+
+    if not ((types == 3) | (types == 4)).any():
+        out = _unfilter_rowwise(types, residuals, stride)
+    else:
+        cols = -(-row_bytes // stride)
+        # Bands as tall as fit the skewed arrays, each continuing from the last row of the one before
+        band_rows = rows
+        while band_rows > 1 and 2 * (band_rows + cols + 1) * (band_rows + 1) * stride > UNFILTER_BAND_BYTES:
+            band_rows //= 2
+        out = np.empty_like(residuals)
+        prev = np.zeros((cols, stride), dtype=np.uint8)
+        for start in range(0, rows, band_rows):
+            end = min(start + band_rows, rows)
+            out[start:end] = _unfilter_wavefront(types[start:end], residuals[start:end], prev, stride)
+            prev = np.zeros(cols * stride, dtype=np.uint8)
+            prev[:row_bytes] = out[end - 1]
+            prev = prev.reshape(cols, stride)
+    return out.tobytes() + bytes(view[rows * (row_bytes + 1):])
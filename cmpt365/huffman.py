@@ -0,0 +1,665 @@
+"""Huffman coding: tree-based codes, their serialization and canonical code lengths"""
+from collections import deque
+
+import numpy as np
+
+from .instrument import stage, timed_stage
+
+# ============= HUFFMAN CODING IMPLEMENTATION =============
+
+class HuffmanNode:
+    """Node for building Huffman tree"""
+    def __init__(self, byte, freq):
+        self.byte = byte
+        self.freq = freq
+        self.left = None
+        self.right = None
+    
+    def __lt__(self, other):
+        return self.freq < other.freq
+
+@timed_stage("huffman_tree")
+def build_huffman_tree(data):
+    """Build Huffman tree from byte data"""
+    if len(data) == 0:
+        return None
+    
+    # Count frequency of each byte value
+    counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    frequency = {byte: int(counts[byte]) for byte in np.flatnonzero(counts).tolist()}
+    
+    # Handle single unique byte case
+    if len(frequency) == 1:
+        byte_val = list(frequency.keys())[0]
+        root = HuffmanNode(byte_val, frequency[byte_val])
+        return root
+    
+    # Build priority queue
+    import heapq
+    heap = [HuffmanNode(byte, freq) for byte, freq in frequency.items()]
+    heapq.heapify(heap)
+    
+    # Build tree
+    while len(heap) > 1:
+        left = heapq.heappop(heap)
+        right = heapq.heappop(heap)
+        
+        parent = HuffmanNode(None, left.freq + right.freq)
+        parent.left = left
+        parent.right = right
+        
+        heapq.heappush(heap, parent)
+    
+    return heap[0]
+
+def build_huffman_codes(root):
+    """Generate Huffman codes from tree"""
+    if root is None:
+        return {}
+    
+    # Handle single byte case
+    if root.byte is not None:
+        return {root.byte: '0'}
+    
+    codes = {}
+    
+    def traverse(node, code):
+        if node is None:
+            return
+        
+        if node.byte is not None:
+            codes[node.byte] = code
+            return
+        
+        traverse(node.left, code + '0')
+        traverse(node.right, code + '1')
+    
+    traverse(root, '')
+    return codes
+
+@timed_stage("huffman_encode")
+def huffman_compress(data):
+    """Compress data using Huffman coding"""
+    if len(data) == 0:
+        return bytes(), None, 0
+    
+    # Build tree and codes
+    tree = build_huffman_tree(data)
+    encoded_bytes, padding = encode_huffman_codes(data, build_huffman_code_table(tree))
+    
+    return encoded_bytes, tree, padding
+
+def build_huffman_code_table(root):
+    """Map every byte in the tree to its (code_value, code_length) pair"""
+    if root is None:
+        return {}
+    
+    # Handle single byte case
+    if root.byte is not None:
+        return {root.byte: (0, 1)}
+    
+    table = {}
+    stack = [(root, 0, 0)]
+    while stack:
+        node, value, length = stack.pop()
+        if node is None:
+            continue
+        if node.byte is not None:
+            table[node.byte] = (value, length)
+            continue
+        stack.append((node.left, value << 1, length + 1))
+        stack.append((node.right, (value << 1) | 1, length + 1))
+    
+    return table
+
+# Input bytes packed per vectorized pass, which bounds the per-symbol work arrays
+HUFFMAN_ENCODE_CHUNK = 1 << 17
+# Inputs at least this long look codes up two bytes at a time from a 65536-entry pair table
+HUFFMAN_PAIR_MIN_BYTES = 1 << 16
+
+#Left-aligned codes and lengths of consecutive symbol groups, each group at most 64 bits
+def _group_codes(symbols, aligned, lengths, pair_codes, pair_lengths):
+    """Adjacent groups are merged pairwise for as long as every merged group
+    still fits in 64 bits, so the packing pass works on a few codes per word
+    instead of one per byte. A group left over from an odd count is set aside
+    and appended back in order."""
+    if pair_codes is None or len(symbols) < 2:
+        return aligned[symbols], lengths[symbols]
+    
+    tails = []
+    if len(symbols) & 1:
+        tails.append((aligned[symbols[-1:]], lengths[symbols[-1:]]))
+        symbols = symbols[:-1]
+    index = symbols.view(np.uint16).astype(np.intp)
+    codes = np.take(pair_codes, index)
+    code_lengths = np.take(pair_lengths, index)
+    
+    while len(codes) > 1:
+        even = len(codes) & ~1
+        merged = code_lengths[0:even:2] + code_lengths[1:even:2]
+        if merged.max() > 64:
+            break
+        if even < len(codes):
+            tails.append((codes[-1:], code_lengths[-1:].astype(np.uint64)))
+        codes = codes[0:even:2] | (codes[1:even:2] >> code_lengths[0:even:2].astype(np.uint64))
+        code_lengths = merged
+    
+    code_lengths = code_lengths.astype(np.uint64)
+    if not tails:
+        return codes, code_lengths
+    return (np.concatenate([codes] + [tail[0] for tail in reversed(tails)]),
+            np.concatenate([code_lengths] + [tail[1] for tail in reversed(tails)]))
+
+@timed_stage("bit_packing")
+def encode_huffman_codes(data, code_table):
+    """Pack the code of every byte MSB-first, returning (encoded_bytes, padding).
+
+    Codes are grouped up to 64 bits, and one cumulative sum of group lengths
+    gives every group its bit offset. A group never spans more than two words
+    and every word starts at least one group, so the part of each group that
+    lands in its first word is summed per word from a running total, and only
+    the last group of a word can spill its low bits into the next one.
+    """
+    aligned = np.zeros(256, dtype=np.uint64)
+    lengths = np.zeros(256, dtype=np.uint64)
+    for byte, (value, length) in code_table.items():
+        if length > 64:
+            raise ValueError("Huffman codes longer than 64 bits are not supported")
+        aligned[byte] = value << (64 - length)
+        lengths[byte] = length
+    
+    source = np.frombuffer(data, dtype=np.uint8)
+    pair_codes = pair_lengths = None
+    if len(source) >= HUFFMAN_PAIR_MIN_BYTES and lengths.max() <= 32:
+        # Indexed by the native uint16 of two bytes, so the first byte is the low one
+        pair_codes = (aligned[None, :] | (aligned[:, None] >> lengths[None, :])).reshape(-1)
+        pair_lengths = (lengths[None, :] + lengths[:, None]).astype(np.uint8).reshape(-1)
+    
+    chunks = []
+    carry_word = np.uint64(0)
+    carry_bits = 0
+    
+    for chunk_start in range(0, len(source), HUFFMAN_ENCODE_CHUNK):
+        symbols = source[chunk_start:chunk_start + HUFFMAN_ENCODE_CHUNK]
+        codes, code_lengths = _group_codes(symbols, aligned, lengths, pair_codes, pair_lengths)
+        
+        starts = np.cumsum(code_lengths)
+        starts += np.uint64(carry_bits)
+        total_bits = int(starts[-1])
+        starts -= code_lengths
+        word_idx = starts >> np.uint64(6)
+        offsets = starts & np.uint64(63)
+        running = np.cumsum(codes >> offsets)
+        
+        # Index of the last group starting in each word
+        last = np.append(np.flatnonzero(word_idx[1:] != word_idx[:-1]), len(codes) - 1)
+        words = np.zeros((total_bits + 63) >> 6, dtype=np.uint64)
+        ends = running[last]
+        words[0] = ends[0] | carry_word
+        np.subtract(ends[1:], ends[:-1], out=words[1:len(last)])
+        spill = last[:len(words) - 1]
+        words[1:len(spill) + 1] |= codes[spill] << (np.uint64(64) - offsets[spill])
+        
+        full_words = total_bits >> 6
+        chunks.append(words[:full_words].astype('>u8').tobytes())
+        carry_bits = total_bits & 63
+        carry_word = words[full_words] if carry_bits else np.uint64(0)
+    
+    if carry_bits:
+        chunks.append(np.array([carry_word], dtype='>u8').tobytes()[:(carry_bits + 7) // 8])
+    
+    padding = (8 - carry_bits % 8) % 8
+    return b''.join(chunks), padding
+
+# Codes up to this many bits resolve with a single table lookup
+HUFFMAN_LOOKUP_BITS = 16
+# Payload bytes decoded per vectorized pass, which bounds the per-bit work arrays
+HUFFMAN_DECODE_CHUNK = 1 << 18
+# Lanes hold about sqrt(bits * mean code length * this) bits, see _HuffmanChunkDecoder
+HUFFMAN_LANE_FACTOR = 0.5
+# Codes every lane steps through between checks for lanes that are done
+HUFFMAN_CHECK_STEPS = 16
+
+def build_huffman_lookup(code_table, lookup_bits=HUFFMAN_LOOKUP_BITS):
+    """Build the decode table indexed by the next `bits` bits of the stream.
+
+    Each entry is (code_length << 8) | byte, or 0 when the code is longer
+    than `bits`; those codes are kept in `long_codes` for the slow path.
+    `quads` holds the code lengths and bytes of the four codes starting on
+    the first four bits of every (bits + 3)-bit window, lengths in the low
+    and bytes in the high little-endian uint32 of each entry, so one lookup
+    per half byte fills four positions.
+    Returns (bits, lookup, quads, long_codes, max_length, mean_length).
+    """
+    max_length = max(length for _, length in code_table.values())
+    bits = min(max_length, lookup_bits)
+    lookup = np.zeros(1 << bits, dtype=np.uint16)
+    long_codes = {}
+    
+    for byte, (value, length) in code_table.items():
+        if length <= bits:
+            shift = bits - length
+            lookup[value << shift:(value + 1) << shift] = (length << 8) | byte
+        else:
+            long_codes[(value, length)] = byte
+    
+    # The code at offset k of a window is the entry of its bits k to k + bits
+    entries = lookup.astype(np.uint64)
+    entries = (entries >> np.uint64(8)) | ((entries & np.uint64(0xFF)) << np.uint64(32))
+    quads = np.zeros(8 << bits, dtype=np.uint64)
+    for offset in range(4):
+        windows = quads.reshape(1 << offset, 1 << bits, 8 >> offset)
+        windows |= (entries << np.uint64(8 * offset))[None, :, None]
+    
+    # Expected code length at a random bit position of a well-compressed stream
+    mean_length = sum(length * 2.0 ** -length for _, length in code_table.values())
+    
+    return bits, lookup, quads, long_codes, max_length, mean_length
+
+def _read_long_code(payload, bit_pos, long_codes, max_length):
+    """Resolve a code longer than the lookup window one length at a time"""
+    span = (max_length + 14) // 8
+    window = int.from_bytes(payload[bit_pos >> 3:(bit_pos >> 3) + span].tobytes().ljust(span, b'\0'), 'big')
+    window_bits = span * 8 - (bit_pos & 7)
+    for length in range(1, max_length + 1):
+        value = (window >> (window_bits - length)) & ((1 << length) - 1)
+        if (value, length) in long_codes:
+            return long_codes[(value, length)], length
+    return None
+
+class _HuffmanChunkDecoder:
+    """Length and byte of the code at every bit position of one chunk, cut into lanes.
+
+    Row i of `lengths` and `symbols` holds the lane_bits positions from
+    i * lane_bits, followed by at least max_length zeros so a chain stops on
+    the first position past its lane; lengths at or past the chunk's limit
+    are zero as well. Lanes are whole bytes, so each half byte of a row is
+    one entry of the lookup's quads.
+    """
+    def __init__(self, payload, chunk_start, chunk_end, limit, lookup_state):
+        self.bits, _, quads, self.long_codes, self.max_length, mean_length = lookup_state
+        self.payload = payload
+        self.base = chunk_start * 8
+        self.invalid = []
+        
+        # Short lanes mean more lanes to link up, long ones more vectorized steps
+        lane_bytes = int(np.sqrt(limit * mean_length * HUFFMAN_LANE_FACTOR)) // 8
+        lane_count = -(-limit // (8 * max(8, lane_bytes)))
+        lane_bytes = -(-limit // (8 * lane_count))
+        self.lane_bits = lane_bytes * 8
+        row_bytes = lane_bytes + (self.max_length + 7) // 8
+        
+        # Big-endian 24-bit word starting at every byte of the lanes
+        window = np.zeros(lane_count * lane_bytes + 2, dtype=np.uint32)
+        tail = payload[chunk_start:chunk_end + 2]
+        window[:len(tail)] = tail
+        words = (window[:-2] << 16) | (window[1:-1] << 8) | window[2:]
+        
+        self.lengths = np.zeros((lane_count, row_bytes * 8), dtype=np.uint8)
+        self.symbols = np.zeros((lane_count, row_bytes * 8), dtype=np.uint8)
+        quad_mask = np.uint32((1 << (self.bits + 3)) - 1)
+        for half in range(2):
+            windows = (words >> np.uint32(21 - self.bits - 4 * half)) & quad_mask
+            entries = quads[windows.reshape(lane_count, lane_bytes)]
+            self.lengths.view('<u4')[:, half:2 * lane_bytes:2] = entries
+            self.symbols.view('<u4')[:, half:2 * lane_bytes:2] = entries >> np.uint64(32)
+        lengths = self.lengths.reshape(-1)
+        lengths[self._cell(limit):self._cell(limit) + self.lane_bits] = 0
+        
+        # Codes longer than the table, or windows that match no code at all
+        unresolved = np.flatnonzero(self.lengths[:, :self.lane_bits] == 0)
+        for row_cell in unresolved.tolist():
+            lane, column = divmod(row_cell, self.lane_bits)
+            position = lane * self.lane_bits + column
+            if position >= limit:
+                break
+            resolved = _read_long_code(self.payload, self.base + position, self.long_codes, self.max_length)
+            if resolved is None:
+                self.invalid.append(position)
+                resolved = (0, 1)
+            self.symbols.reshape(-1)[self._cell(position)] = resolved[0]
+            lengths[self._cell(position)] = resolved[1]
+    
+    def _cell(self, position):
+        """Flat index into `lengths` of a chunk bit position"""
+        lane = position // self.lane_bits
+        return lane * self.lengths.shape[1] + position - lane * self.lane_bits
+    
+    def position(self, cell):
+        """Chunk bit position of a flat index into `lengths`"""
+        lane, column = divmod(cell, self.lengths.shape[1])
+        return lane * self.lane_bits + column
+
+def _walk_lanes(lengths, cells, visited):
+    """Step one chain per lane from `cells` until each leaves its lane,
+    marking the cells it decodes in `visited`; returns the exit cells"""
+    cells = cells.copy()
+    while True:
+        for _ in range(HUFFMAN_CHECK_STEPS):
+            visited[cells] = True
+            cells += lengths[cells]
+        if not lengths[cells].any():
+            # A chain only waits on its exit cell, which was marked meanwhile
+            visited[cells] = False
+            return cells
+
+def _trace_lanes(lengths, cells):
+    """Step one chain per lane from `cells` until each leaves its lane;
+    returns the cells each chain decodes, lane by lane, and the exit cells"""
+    trace = []
+    while True:
+        for _ in range(HUFFMAN_CHECK_STEPS):
+            trace.append(cells)
+            cells = cells + lengths[cells]
+        if not lengths[cells].any():
+            path = np.stack(trace, axis=1)
+            # A chain waiting on its exit cell keeps tracing it with length 0
+            return path[lengths[path] != 0], cells
+
+def _follow_code_chain(decoder, start):
+    """Decode the codes from chunk position `start` up to the chunk's limit.
+
+    Every lane is decoded from each bit offset the code before it could
+    leave off at, so lanes never wait on each other or rely on codes
+    resynchronizing. Offsets whose chain joins the one from the lane's
+    first bit stop early; only near fixed-length codes keep all of them to
+    the end of the lane. One pass over the lanes then links each lane's
+    real entry to the previous lane's exit, and the real chains are walked
+    once more for their codes. Returns the decoded bytes and the position
+    where the chain leaves the chunk.
+    """
+    lane_count, width = decoder.lengths.shape
+    lengths = decoder.lengths.reshape(-1)
+    lane_cells = np.arange(lane_count, dtype=np.int64) * width
+    offsets = decoder.max_length
+    
+    # Chains entering each lane on its first bit
+    first_chain = np.zeros(len(lengths), dtype=bool)
+    exits = np.empty((lane_count, offsets), dtype=np.int64)
+    exits[:, 0] = _walk_lanes(lengths, lane_cells, first_chain)
+    
+    # Chains entering on every other offset, until they leave the lane or join the first chain
+    cells = (lane_cells[:, None] + np.arange(1, offsets)).reshape(-1)
+    pending = np.arange(len(cells))
+    while pending.size:
+        for _ in range(HUFFMAN_CHECK_STEPS):
+            cells += lengths[cells]
+        joined = first_chain[cells]
+        done = joined | (lengths[cells] == 0)
+        if done.any():
+            finished = pending[done]
+            lanes = finished // (offsets - 1)
+            exits[lanes, finished % (offsets - 1) + 1] = np.where(joined[done], exits[lanes, 0], cells[done])
+            pending = pending[~done]
+            cells = cells[~done]
+    
+    # Follow each lane's exit into the next lane's entry offset
+    next_offsets = (exits - lane_cells[:, None] - decoder.lane_bits).tolist()
+    entry_offsets = []
+    offset = start
+    for lane_exits in next_offsets:
+        entry_offsets.append(offset)
+        offset = lane_exits[offset]
+    
+    path, exit_cells = _trace_lanes(lengths, lane_cells + entry_offsets)
+    if decoder.invalid and np.isin([decoder._cell(position) for position in decoder.invalid], path).any():
+        raise ValueError("Invalid Huffman code in compressed data")
+    return decoder.symbols.reshape(-1)[path].tobytes(), decoder.position(int(exit_cells[-1]))
+
+#Decode a Huffman stream chunk by chunk, yielding the bytes of each chunk as soon as it is done
+def iter_huffman_bits(compressed_data, code_table, bit_count):
+    """Yield the decoded bytes of `bit_count` bits of a Huffman stream, one
+    HUFFMAN_DECODE_CHUNK of input at a time, using a k-bit lookup table"""
+    with stage("huffman_decode", len(compressed_data)):
+        lookup_state = build_huffman_lookup(code_table)
+        payload = np.frombuffer(compressed_data, dtype=np.uint8)
+    
+    pos = 0
+    for chunk_start in range(0, len(payload), HUFFMAN_DECODE_CHUNK):
+        chunk_end = min(chunk_start + HUFFMAN_DECODE_CHUNK, len(payload))
+        base = chunk_start * 8
+        limit = min(bit_count, chunk_end * 8) - base
+        if pos - base >= limit:
+            continue
+        
+        with stage("huffman_decode") as s:
+            decoder = _HuffmanChunkDecoder(payload, chunk_start, chunk_end, limit, lookup_state)
+            chunk_bytes, exit_pos = _follow_code_chain(decoder, pos - base)
+            pos = base + exit_pos
+            # A code running into the padding is an incomplete trailing symbol
+            if pos > bit_count:
+                chunk_bytes = chunk_bytes[:-1]
+            s.bytes_out = len(chunk_bytes)
+        yield chunk_bytes
+
+def decode_huffman_bits(compressed_data, code_table, bit_count):
+    """Decode `bit_count` bits of a Huffman stream with a k-bit lookup table"""
+    return b''.join(iter_huffman_bits(compressed_data, code_table, bit_count))
+
+#Decompress Huffman encoded data progressively, as chunks of decoded bytes
+def iter_huffman_decompress(compressed_data, tree, padding):
+    if tree is None or len(compressed_data) == 0:
+        return
+    
+    bit_count = len(compressed_data) * 8 - padding
+    
+    # Handle single byte tree
+    if tree.byte is not None:
+        # All bits decode to the same byte
+        yield bytes([tree.byte]) * bit_count
+        return
+    
+    yield from iter_huffman_bits(compressed_data, build_huffman_code_table(tree), bit_count)
+
+def huffman_decompress(compressed_data, tree, padding):
+    """Decompress Huffman encoded data"""
+    return b''.join(iter_huffman_decompress(compressed_data, tree, padding))
+
+# ============= CUSTOM HUFFMAN TREE SERIALIZATION =============
+
+#Serialize Huffman tree to bytes without pickle
+def serialize_huffman_tree(node):
+    if node is None:
+        return b''
+    
+    result = bytearray()
+    
+    def serialize_node(current_node):
+        if current_node is None:
+            return
+        
+        # Node marker, 0 for leaf, 1 for internal
+        if current_node.byte is not None:
+            # Leaf node: marker (0) + byte value
+            result.append(0)
+            result.append(current_node.byte)
+        else:
+            # Internal node: marker (1)
+            result.append(1)
+            serialize_node(current_node.left)
+            serialize_node(current_node.right)
+    
+    serialize_node(node)
+    return bytes(result)
+
+#Deserialize Huffman tree from bytes without pickle
+def deserialize_huffman_tree(data):
+    if not data:
+        return None
+    
+    data_queue = deque(data)
+    
+    def deserialize_node():
+        if not data_queue:
+            return None
+        
+        marker = data_queue.popleft()
+        
+        if marker == 0:  # Leaf node
+            if data_queue:
+                byte_val = data_queue.popleft()
+                return HuffmanNode(byte_val, 0)
+            else:
+                return None
+        elif marker == 1:  # Internal node
+            node = HuffmanNode(None, 0)
+            node.left = deserialize_node()
+            node.right = deserialize_node()
+            return node
+        else:
+            return None
+    
+    return deserialize_node()
+
+# ============= CANONICAL HUFFMAN CODES =============
+
+# Longest code the canonical encoder emits, so decode tables stay 4096 entries
+HUFFMAN_MAX_CODE_LENGTH = 12
+
+# Code length table formats
+LENGTHS_RAW = 0      # one byte per symbol
+LENGTHS_NIBBLES = 1  # two symbols per byte, high nibble first
+LENGTHS_RUNS = 2     # (run, length) byte pairs
+
+def huffman_code_lengths(frequencies, max_length=None):
+    """Code length of every symbol (0 when unused) for a frequency array"""
+    import heapq
+    frequencies = np.asarray(frequencies)
+    lengths = np.zeros(len(frequencies), dtype=np.int64)
+    symbols = np.flatnonzero(frequencies)
+    
+    if len(symbols) == 0:
+        return lengths
+    if len(symbols) == 1:
+        lengths[symbols[0]] = 1
+        return lengths
+    
+    # Merge nodes by frequency, only remembering each node's parent
+    heap = [(int(frequencies[symbol]), node) for node, symbol in enumerate(symbols)]
+    heapq.heapify(heap)
+    parent = [-1] * len(symbols)
+    while len(heap) > 1:
+        freq_a, node_a = heapq.heappop(heap)
+        freq_b, node_b = heapq.heappop(heap)
+        parent[node_a] = parent[node_b] = len(parent)
+        heapq.heappush(heap, (freq_a + freq_b, len(parent)))
+        parent.append(-1)
+    
+    # Parents are always created after their children
+    depth = [0] * len(parent)
+    for node in range(len(parent) - 2, -1, -1):
+        depth[node] = depth[parent[node]] + 1
+    lengths[symbols] = depth[:len(symbols)]
+    
+    if max_length is not None and lengths.max() > max_length:
+        lengths = limit_code_lengths(lengths, frequencies, max_length)
+    return lengths
+
+def limit_code_lengths(lengths, frequencies, max_length):
+    """Shorten codes to max_length bits, keeping the code complete.
+
+    Uses the JPEG (ITU T.81 K.3) adjustment of the per-length code counts,
+    then hands the shortest lengths to the most frequent symbols.
+    """
+    used = np.flatnonzero(lengths)
+    if len(used) > 1 << max_length:
+        raise ValueError(f"{len(used)} symbols do not fit in {max_length}-bit codes")
+    
+    counts = np.bincount(lengths[used], minlength=int(lengths.max()) + 1).tolist()
+    for length in range(len(counts) - 1, max_length, -1):
+        while counts[length] > 0:
+            shorter = length - 2
+            while counts[shorter] == 0:
+                shorter -= 1
+            # Move a pair of leaves up and split a shorter leaf to hold one of them
+            counts[length] -= 2
+            counts[length - 1] += 1
+            counts[shorter + 1] += 2
+            counts[shorter] -= 1
+    
+    by_frequency = used[np.lexsort((used, -frequencies[used]))]
+    limited = np.zeros_like(lengths)
+    limited[by_frequency] = np.repeat(np.arange(len(counts)), counts)[:len(used)]
+    return limited
+
+def canonical_code_table(lengths):
+    """Map every used symbol to its canonical (code_value, code_length) pair"""
+    table = {}
+    code = 0
+    prev_length = 0
+    for length, symbol in sorted((int(length), symbol) for symbol, length in enumerate(lengths) if length):
+        code <<= length - prev_length
+        table[symbol] = (code, length)
+        code += 1
+        prev_length = length
+    return table
+
+#Serialize code lengths in whichever table format is smallest
+def serialize_code_lengths(lengths):
+    lengths = np.asarray(lengths, dtype=np.uint8)
+    
+    runs = bytearray()
+    change = np.flatnonzero(np.diff(lengths)) + 1
+    for start, end in zip(np.concatenate(([0], change)).tolist(), np.concatenate((change, [len(lengths)])).tolist()):
+        for run_start in range(start, end, 255):
+            runs.append(min(255, end - run_start))
+            runs.append(lengths[start])
+    candidates = [bytes([LENGTHS_RAW]) + lengths.tobytes(), bytes([LENGTHS_RUNS]) + bytes(runs)]
+    
+    if lengths.max(initial=0) <= 15:
+        padded = np.zeros(len(lengths) + len(lengths) % 2, dtype=np.uint8)
+        padded[:len(lengths)] = lengths
+        candidates.append(bytes([LENGTHS_NIBBLES]) + ((padded[0::2] << 4) | padded[1::2]).tobytes())
+    
+    return min(candidates, key=len)
+
+#Deserialize code lengths for `symbol_count` symbols
+def deserialize_code_lengths(data, symbol_count=256):
+    if not data:
+        raise ValueError("Missing code length table")
+    
+    table_format = data[0]
+    body = np.frombuffer(data, dtype=np.uint8, offset=1)
+    if table_format == LENGTHS_RAW:
+        lengths = body
+    elif table_format == LENGTHS_NIBBLES:
+        lengths = np.empty(len(body) * 2, dtype=np.uint8)
+        lengths[0::2] = body >> 4
+        lengths[1::2] = body & 0xF
+    elif table_format == LENGTHS_RUNS:
+        lengths = np.repeat(body[1::2], body[0::2][:len(body) // 2])
+    else:
+        raise ValueError(f"Unknown code length table format: {table_format}")
+    
+    if len(lengths) < symbol_count:
+        raise ValueError("Code length table is truncated")
+    return lengths[:symbol_count].astype(np.int64)
+
+def canonical_huffman_size(frequencies, max_code_length=HUFFMAN_MAX_CODE_LENGTH):
+    """(table_size, payload_size) canonical_huffman_compress would produce for this histogram"""
+    frequencies = np.asarray(frequencies, dtype=np.int64)
+    lengths = huffman_code_lengths(frequencies, max_code_length)
+    bit_count = int((frequencies * lengths).sum())
+    return len(serialize_code_lengths(lengths)), (bit_count + 7) // 8
+
+@timed_stage("canonical_huffman_encode")
+def canonical_huffman_compress(data, max_code_length=HUFFMAN_MAX_CODE_LENGTH):
+    """Compress data with canonical Huffman codes, returning (encoded, lengths, padding)"""
+    if len(data) == 0:
+        return bytes(), np.zeros(256, dtype=np.int64), 0
+    
+    frequencies = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    lengths = huffman_code_lengths(frequencies, max_code_length)
+    encoded_bytes, padding = encode_huffman_codes(data, canonical_code_table(lengths))
+    return encoded_bytes, lengths, padding
+
+#Decompress canonical Huffman data progressively, as chunks of decoded bytes
+def iter_canonical_huffman_decompress(compressed_data, lengths, padding):
+    code_table = canonical_code_table(lengths)
+    if not code_table or len(compressed_data) == 0:
+        return
+    yield from iter_huffman_bits(compressed_data, code_table, len(compressed_data) * 8 - padding)
+
+def canonical_huffman_decompress(compressed_data, lengths, padding):
+    """Decompress data encoded with canonical codes of the given lengths"""
+    return b''.join(iter_canonical_huffman_decompress(compressed_data, lengths, padding))
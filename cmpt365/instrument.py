@@ -0,0 +1,248 @@
+"""Opt-in wall time, byte counts and peak memory for each named pipeline stage
+
+Nothing is measured unless a recording() block is active or a stage hook is
+registered; otherwise stage() costs one context variable lookup.
+
+    with recording(memory=True) as stats:
+        compress_bmp_file("image.bmp")
+    print(stats.summary())
+
+Stages nest; each one records its depth so reports can indent them. Stages
+that run in worker processes are only covered by the stage around the
+submission in the calling process.
+"""
+import contextvars
+import functools
+import time
+import tracemalloc
+
+class StageStats:
+    """Measurements of one completed stage; path holds the names of its enclosing stages and its own"""
+    __slots__ = ("path", "started", "seconds", "bytes_in", "bytes_out", "peak_bytes")
+
+    def __init__(self, path, started=0.0, seconds=0.0, bytes_in=None, bytes_out=None, peak_bytes=None):
+        self.path = tuple(path)
+        self.started = started  # perf_counter() at entry
+        self.seconds = seconds
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.peak_bytes = peak_bytes
+
+    @property
+    def name(self):
+        return self.path[-1]
+
+    @property
+    def depth(self):
+        return len(self.path) - 1
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"StageStats({'/'.join(self.path)!r}, {self.seconds * 1000:.2f} ms, in={self.bytes_in}, out={self.bytes_out})"
+
+class Stats:
+    """Stages recorded by one or more recording() blocks, in the order they finished"""
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def __len__(self):
+        return len(self.stages)
+
+    @property
+    def seconds(self):
+        """Wall time of the outermost stages"""
+        return sum(s.seconds for s in self.stages if s.depth == 0)
+
+    def totals(self):
+        """{path: StageStats} summed over every occurrence of each stage path,
+        ordered depth first with siblings in the order they first started"""
+        totals = {}
+        for s in self.stages:
+            total = totals.setdefault(s.path, StageStats(s.path, s.started))
+            total.started = min(total.started, s.started)
+            total.seconds += s.seconds
+            for field in ("bytes_in", "bytes_out"):
+                if getattr(s, field) is not None:
+                    setattr(total, field, (getattr(total, field) or 0) + getattr(s, field))
+            if s.peak_bytes is not None:
+                total.peak_bytes = max(total.peak_bytes or 0, s.peak_bytes)
+        
+        def tree_order(path):
+            return tuple(totals[path[:i]].started if path[:i] in totals else 0.0 for i in range(1, len(path) + 1))
+        return {path: totals[path] for path in sorted(totals, key=tree_order)}
+
+    def extend(self, other):
+        self.stages.extend(other)
+
+    def to_dict(self):
+        return {"seconds": self.seconds, "stages": [s.to_dict() for s in self.stages]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(StageStats(**s) for s in data["stages"])
+
+    def summary(self, aggregate=True):
+        """One line per stage: indented name, milliseconds, bytes in and out, peak memory"""
+        if aggregate:
+            stages = self.totals().values()
+        else:
+            stages = sorted(self.stages, key=lambda s: s.started)
+        lines = []
+        for s in stages:
+            line = f"{'  ' * s.depth + s.name:<28} {s.seconds * 1000:10.2f} ms"
+            if s.bytes_in is not None:
+                line += f"  in {s.bytes_in:>12,}"
+            if s.bytes_out is not None:
+                line += f"  out {s.bytes_out:>12,}"
+            if s.peak_bytes is not None:
+                line += f"  peak {s.peak_bytes / 1e6:8.2f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+# ============= RECORDING =============
+
+_hooks = []
+
+#Call hook(stage_stats) for every stage that finishes, in any thread, from now on
+def add_stage_hook(hook):
+    _hooks.append(hook)
+
+def remove_stage_hook(hook):
+    _hooks.remove(hook)
+
+class _Recorder:
+    def __init__(self, stats, memory, hook):
+        self.stats = stats
+        self.memory = memory
+        self.hook = hook
+        self.stack = []
+
+    def emit(self, stage_stats):
+        if self.stats is not None:
+            self.stats.stages.append(stage_stats)
+        if self.hook is not None:
+            self.hook(stage_stats)
+        for hook in _hooks:
+            hook(stage_stats)
+
+_recorder = contextvars.ContextVar("cmpt365_recorder", default=None)
+_hook_recorder = contextvars.ContextVar("cmpt365_hook_recorder", default=None)
+
+class recording:
+    """Context manager collecting every stage run inside it into a Stats object
+
+    memory=True traces allocations with tracemalloc, which slows the
+    pipeline down noticeably; hook is called with each finished stage.
+    """
+    def __init__(self, memory=False, hook=None):
+        self.stats = Stats()
+        self._recorder = _Recorder(self.stats, memory, hook)
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self._recorder.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._token = _recorder.set(self._recorder)
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        _recorder.reset(self._token)
+        if self._started_tracing:
+            tracemalloc.stop()
+
+class _Stage:
+    """A running stage; set bytes_out before the block ends"""
+    def __init__(self, recorder, name, bytes_in):
+        self.recorder = recorder
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+        self.peak = 0
+
+    def __enter__(self):
+        self.depth = len(self.recorder.stack)
+        self.recorder.stack.append(self)
+        if self.recorder.memory:
+            self.baseline = tracemalloc.get_traced_memory()[0]
+            self._fold_peak_into_parent()
+        self.start = time.perf_counter()
+        return self
+
+    def _fold_peak_into_parent(self):
+        # The parent's peak so far must survive this stage resetting the counter
+        if self.depth > 0:
+            parent = self.recorder.stack[self.depth - 1]
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.recorder.stack.pop()
+        peak_bytes = None
+        if self.recorder.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = max(0, self.peak - self.baseline)
+            if self.depth > 0:
+                parent = self.recorder.stack[self.depth - 1]
+                parent.peak = max(parent.peak, self.peak)
+                tracemalloc.reset_peak()
+        path = tuple(parent.name for parent in self.recorder.stack) + (self.name,)
+        self.recorder.emit(StageStats(path, self.start, seconds, self.bytes_in, self.bytes_out, peak_bytes))
+
+class _NullStage:
+    """Stand-in used when nothing is recording; attribute writes are ignored"""
+    bytes_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+#Measure the block it wraps as a named stage, if anything is recording
+def stage(name, bytes_in=None):
+    recorder = _recorder.get()
+    if recorder is None:
+        if not _hooks:
+            return _NULL_STAGE
+        # Hooks without a recording block: report stages but keep no Stats
+        recorder = _hook_recorder.get()
+        if recorder is None:
+            recorder = _Recorder(None, False, None)
+            _hook_recorder.set(recorder)
+    return _Stage(recorder, name, bytes_in)
+
+#Size in bytes of a stage's input or output, or None when it has no obvious size
+def _byte_size(value):
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return None
+
+#Decorator measuring every call as a stage, sized by its first argument and its result
+def timed_stage(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(data, *args, **kwargs):
+            if _recorder.get() is None and not _hooks:
+                return func(data, *args, **kwargs)
+            with stage(name, _byte_size(data)) as s:
+                result = func(data, *args, **kwargs)
+                s.bytes_out = _byte_size(result)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,303 @@
+"""LZSS dictionary coding: repeated byte strings replaced by (length, distance) matches
+
+A payload is parsed greedily into sequences of a literal run followed by
+one match; bytes after the last match are a final literal run. Matches are
+looked up at the fixed distances that repeat in images (the previous byte,
+pixel and row) and, depending on the effort level, along hash chains of
+earlier positions with the same four leading bytes. All candidate lengths
+are computed with NumPy a chunk at a time; only the greedy walk from one
+taken match to the next is a Python loop.
+
+Run lengths, match lengths and distances are written as a symbol byte plus
+extra bits, so each kind of value can be Huffman coded as a byte stream.
+Symbols 0-15 are the value itself; larger values store their bit length
+and second-highest bit in the symbol and the remaining low bits as extra
+bits. Distance 0 means "the distance of the previous match" and the next
+few values stand for the fixed distances, so matches one row or pixel
+back stay cheap however far away the matches between them reach.
+"""
+import numpy as np
+
+from .instrument import timed_stage
+
+# Shortest match the parser takes; shorter repeats cost more than their literals
+LZSS_MIN_MATCH = 4
+# Longest match, so lengths stay well inside their symbol range
+LZSS_MAX_MATCH = 1 << 16
+# Farthest distance a match may reach back
+LZSS_WINDOW = 1 << 18
+# Hash-chain candidates tried per position at each effort level; level 0
+# only tries the previous byte, pixel and row
+LZSS_EFFORT_CHAINS = (0, 1, 4, 16)
+LZSS_DEFAULT_EFFORT = 1
+# Longest match checked for a hash-chain candidate; fixed distances have no such limit
+LZSS_CHAIN_MATCH = 258
+# Bytes a hash-chain match must add to a fixed-distance match to replace it,
+# since arbitrary distances cost more to code
+LZSS_CHAIN_GAIN = 2
+# Bytes the match one position later must add to be taken instead (lazy matching)
+LZSS_LAZY_GAIN = 2
+# Positions whose fixed-distance match is already this long skip the hash chains
+LZSS_NICE_MATCH = 64
+# Positions parsed per vectorized pass
+LZSS_CHUNK = 1 << 20
+
+# Values below this are their own symbol
+_DIRECT_VALUES = 16
+
+#Longest run of equal bytes between seg[i] and seg[i - distance] for every i in [lo, hi)
+def _fixed_distance_lengths(seg, lo, hi, distance):
+    lengths = np.zeros(hi - lo, dtype=np.int64)
+    first = max(lo, distance)
+    if first >= hi:
+        return lengths
+    equal = seg[first:] == seg[first - distance:len(seg) - distance]
+    idx = np.arange(len(equal))
+    next_unequal = np.where(equal, len(equal), idx)
+    next_unequal = np.minimum.accumulate(next_unequal[::-1])[::-1]
+    lengths[first - lo:] = (next_unequal - idx)[:hi - first]
+    return lengths
+
+#Length of the common prefix of seg[pos:] and seg[cand:], up to limit, eight bytes at a time
+def _match_lengths(words, pos, cand, limit):
+    lengths = np.zeros(len(pos), dtype=np.int64)
+    active = np.flatnonzero(limit > 0)
+    while active.size:
+        diff = words[pos[active] + lengths[active]] ^ words[cand[active] + lengths[active]]
+        same = diff == 0
+        # Little-endian words: the first differing byte holds the lowest set bit
+        lowest = diff & (~diff + np.uint64(1))
+        matched = (np.frexp(lowest.astype(np.float64))[1] - 1) // 8
+        lengths[active] += np.where(same, 8, matched)
+        active = active[same & (lengths[active] < limit[active])]
+    return np.minimum(lengths, limit)
+
+#Best (length, distance) match at every position in [lo, hi) of seg
+def _best_matches(seg, lo, hi, fixed_distances, chains, window):
+    best_len = np.zeros(hi - lo, dtype=np.int64)
+    best_dist = np.zeros(hi - lo, dtype=np.int64)
+    max_len = np.minimum(len(seg) - np.arange(lo, hi), LZSS_MAX_MATCH)
+    for distance in fixed_distances:
+        lengths = np.minimum(_fixed_distance_lengths(seg, lo, hi, distance), max_len)
+        better = lengths > best_len
+        best_len[better] = lengths[better]
+        best_dist[better] = distance
+    if not chains:
+        return best_len, best_dist
+
+    # Unaligned little-endian views of every position; the padding is never counted as a match
+    padded = np.concatenate((seg, np.zeros(8, dtype=np.uint8)))
+    words = np.ndarray((len(seg) + 1,), dtype='<u8', buffer=padded, strides=(1,))
+    keys = np.ndarray((len(seg) + 5,), dtype='<u4', buffer=padded, strides=(1,))[:len(seg)]
+
+    # Link every position to the previous one starting with the same four
+    # bytes; two stable 16-bit sorts (radix sorts in NumPy) order the keys
+    order = np.argsort((keys & 0xFFFF).astype(np.uint16), kind='stable')
+    order = order[np.argsort((keys[order] >> 16).astype(np.uint16), kind='stable')]
+    sorted_keys = keys[order]
+    same = sorted_keys[1:] == sorted_keys[:-1]
+    prev = np.full(len(seg), -1, dtype=np.int32)
+    prev[order[1:][same]] = order[:-1][same]
+
+    searched = np.flatnonzero(best_len < LZSS_NICE_MATCH)
+    pos = searched + lo
+    cand = prev[pos]
+    limit = np.minimum(max_len[searched], LZSS_CHAIN_MATCH)
+    fixed_len = best_len[searched]
+    to_beat = np.where(fixed_len > 0, fixed_len + LZSS_CHAIN_GAIN, 0)
+    for _ in range(chains):
+        valid = np.flatnonzero((cand >= 0) & (pos - cand <= window))
+        if not valid.size:
+            break
+        valid_cand = cand[valid]
+        lengths = _match_lengths(words, pos[valid], valid_cand, limit[valid])
+        better = lengths > np.maximum(best_len[searched[valid]], to_beat[valid])
+        best_len[searched[valid[better]]] = lengths[better]
+        best_dist[searched[valid[better]]] = pos[valid[better]] - valid_cand[better]
+        cand = np.full_like(cand, -1)
+        cand[valid] = prev[valid_cand]
+    return best_len, best_dist
+
+#Distances always tried as matches: the previous byte, pixel and row
+def lzss_fixed_distances(row_bytes=None, stride=1, window=LZSS_WINDOW):
+    return tuple(sorted({d for d in (1, stride, row_bytes) if d and d <= window}))
+
+#Greedy LZSS parse of data, as (match starts, match lengths, distances)
+@timed_stage("lzss_parse")
+def lzss_parse(data, row_bytes=None, stride=1, effort=LZSS_DEFAULT_EFFORT, window=LZSS_WINDOW):
+    """Every position takes its longest match, if any is LZSS_MIN_MATCH bytes
+    long; the parse then resumes after the match. row_bytes and stride add
+    the previous row and pixel as fixed candidate distances."""
+    if not 0 <= effort < len(LZSS_EFFORT_CHAINS):
+        raise ValueError(f"Unknown LZSS effort level: {effort}")
+    source = np.frombuffer(data, dtype=np.uint8)
+    n = len(source)
+    fixed_distances = lzss_fixed_distances(row_bytes, stride, window)
+    chains = LZSS_EFFORT_CHAINS[effort]
+
+    starts, lengths, distances = [], [], []
+    pos = 0
+    for chunk_start in range(0, n, LZSS_CHUNK):
+        chunk_end = min(chunk_start + LZSS_CHUNK, n)
+        if pos >= chunk_end:
+            continue
+        # The window before the chunk, plus the longest match after it
+        base = max(0, pos - window)
+        seg = source[base:min(n, chunk_end + LZSS_MAX_MATCH)]
+        best_len, best_dist = _best_matches(seg, pos - base, chunk_end - base, fixed_distances, chains, window)
+
+        # Next position with a usable match, at or after every position
+        m = len(best_len)
+        usable = np.flatnonzero(best_len >= LZSS_MIN_MATCH)
+        next_match = np.full(m + 1, m, dtype=np.int64)
+        next_match[usable] = usable
+        next_match = np.minimum.accumulate(next_match[::-1])[::-1]
+
+        steps = memoryview(next_match)
+        jumps = memoryview(best_len)
+        taken = []
+        p = 0
+        while True:
+            p = steps[p]
+            if p >= m:
+                break
+            if p + 1 < m and jumps[p + 1] > jumps[p] + LZSS_LAZY_GAIN:
+                p += 1  # lazy matching: a longer match starts one byte later
+            taken.append(p)
+            p += jumps[p]
+            if p >= m:
+                break
+        taken = np.array(taken, dtype=np.int64)
+        starts.append(taken + pos)
+        lengths.append(best_len[taken])
+        distances.append(best_dist[taken])
+        pos += max(m, p)
+    
+    if not starts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    return np.concatenate(starts), np.concatenate(lengths), np.concatenate(distances)
+
+#Matches of a parse that fit inside data[start:end], as a parse of that slice
+def lzss_cut_parse(parse, start, end):
+    """Matches reaching back before start become literals and matches running
+    past end are shortened, or become literals when that leaves them below
+    LZSS_MIN_MATCH; the result is a valid parse of data[start:end] alone."""
+    starts, lengths, distances = parse
+    lo, hi = np.searchsorted(starts, (start, end))
+    starts, lengths, distances = starts[lo:hi], lengths[lo:hi], distances[lo:hi]
+    lengths = np.minimum(lengths, end - starts)
+    keep = (starts - distances >= start) & (lengths >= LZSS_MIN_MATCH)
+    return starts[keep] - start, lengths[keep], distances[keep]
+
+# ============= SEQUENCE STREAMS =============
+
+#Split non-negative values into (symbols, extra bit counts, extra bits)
+def split_values(values):
+    values = np.asarray(values, dtype=np.int64)
+    bit_length = np.frexp(values.astype(np.float64))[1]
+    extra_count = np.where(values < _DIRECT_VALUES, 0, bit_length - 2)
+    second_bit = (values >> np.maximum(extra_count, 0)) & 1
+    symbols = np.where(values < _DIRECT_VALUES, values, _DIRECT_VALUES + 2 * (bit_length - 5) + second_bit)
+    extra = values & ((np.int64(1) << extra_count) - 1)
+    return symbols.astype(np.uint8), extra_count, extra
+
+#Extra bit count of every symbol split_values produced
+def extra_bit_counts(symbols):
+    symbols = np.asarray(symbols, dtype=np.int64)
+    return np.where(symbols < _DIRECT_VALUES, 0, (symbols - _DIRECT_VALUES) // 2 + 3)
+
+#Invert split_values
+def join_values(symbols, extra):
+    symbols = np.asarray(symbols, dtype=np.int64)
+    counts = extra_bit_counts(symbols)
+    high = (np.int64(2) | ((symbols - _DIRECT_VALUES) & 1)) << counts
+    return np.where(symbols < _DIRECT_VALUES, symbols, high | extra)
+
+#Pack values most significant bit first, counts[i] bits for values[i]
+def pack_bits(values, counts):
+    total = int(counts.sum())
+    if total == 0:
+        return bytes()
+    owner = np.repeat(np.arange(len(counts)), counts)
+    first_bit = np.cumsum(counts) - counts
+    shift = counts[owner] - 1 - (np.arange(total) - first_bit[owner])
+    return np.packbits(((values[owner] >> shift) & 1).astype(np.uint8)).tobytes()
+
+#Invert pack_bits
+def unpack_bits(data, counts):
+    total = int(counts.sum())
+    values = np.zeros(len(counts), dtype=np.int64)
+    if total == 0:
+        return values
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    if len(bits) < total:
+        raise ValueError("LZSS extra bits are truncated")
+    owner = np.repeat(np.arange(len(counts)), counts)
+    first_bit = np.cumsum(counts) - counts
+    shift = counts[owner] - 1 - (np.arange(total) - first_bit[owner])
+    weighted = bits[:total].astype(np.int64) << shift
+    has_bits = np.flatnonzero(counts)
+    values[has_bits] = np.add.reduceat(weighted, first_bit[has_bits])
+    return values
+
+#Turn a parse into byte streams: literals, run symbols, length symbols, distance symbols, extra bits
+def lzss_streams(data, starts, lengths, distances, fixed_distances=()):
+    """Return ([literals, runs, lengths, distances] as bytes, extra bits bytes)"""
+    source = np.frombuffer(data, dtype=np.uint8)
+    ends = starts + lengths
+    runs = starts - np.concatenate(([0], ends[:-1]))
+    
+    covered = np.zeros(len(source) + 1, dtype=np.int8)
+    np.add.at(covered, starts, 1)
+    np.add.at(covered, ends, -1)
+    literals = source[np.cumsum(covered[:-1], dtype=np.int8) == 0]
+
+    # 0 repeats the previous distance, 1..k are the fixed distances, the rest are shifted by k
+    stored = distances + len(fixed_distances)
+    for code, distance in enumerate(fixed_distances, 1):
+        stored[distances == distance] = code
+    stored[1:][distances[1:] == distances[:-1]] = 0
+    split = [split_values(values) for values in (runs, lengths - LZSS_MIN_MATCH, stored)]
+    extra = pack_bits(np.concatenate([e for _, _, e in split]), np.concatenate([c for _, c, _ in split]))
+    return [literals.tobytes()] + [symbols.tobytes() for symbols, _, _ in split], extra
+
+#Rebuild the payload from decoded streams
+def lzss_rebuild(literals, run_symbols, length_symbols, distance_symbols, extra, min_match=LZSS_MIN_MATCH,
+                 fixed_distances=()):
+    symbols = [np.frombuffer(s, dtype=np.uint8) for s in (run_symbols, length_symbols, distance_symbols)]
+    if not len(symbols[0]) == len(symbols[1]) == len(symbols[2]):
+        raise ValueError("LZSS streams have different lengths")
+    counts = [extra_bit_counts(s) for s in symbols]
+    extra_values = np.split(unpack_bits(extra, np.concatenate(counts)), np.cumsum([len(c) for c in counts])[:-1])
+    runs, lengths, stored = (join_values(s, e) for s, e in zip(symbols, extra_values))
+    lengths += min_match
+
+    distances = stored - len(fixed_distances)
+    for code, distance in enumerate(fixed_distances, 1):
+        distances[stored == code] = distance
+    # Distance 0 repeats the last distance that was stored
+    distances[stored == 0] = 0
+    last_stored = np.where(stored != 0, np.arange(len(stored)), 0)
+    distances = distances[np.maximum.accumulate(last_stored)] if len(distances) else distances
+    if len(distances) and distances.min() == 0:
+        raise ValueError("LZSS match repeats a missing distance")
+    if runs.sum() > len(literals):
+        raise ValueError("LZSS literals are truncated")
+
+    out = bytearray()
+    literals = memoryview(literals)
+    literal_pos = 0
+    for run, length, distance in zip(runs.tolist(), lengths.tolist(), distances.tolist()):
+        out += literals[literal_pos:literal_pos + run]
+        literal_pos += run
+        start = len(out) - distance
+        if start < 0:
+            raise ValueError("LZSS match reaches before the start")
+        if distance >= length:
+            out += out[start:start + length]
+        else:
+            # Overlapping copy: the last `distance` bytes repeat
+            out += (out[start:] * (length // distance + 1))[:length]
+    out += literals[literal_pos:]
+    return bytes(out)
@@ -0,0 +1,60 @@
+"""Planar colour coding for 24 bpp payloads: B, G and R planes coded separately
+
+Each stored row is viewed as row_bytes // 3 whole BGR pixels followed by
+row_bytes % 3 spare bytes. The B, G and R planes are strided views of those
+pixels; every row's spare bytes plus anything after the last whole row form a
+fourth plane, so the split is lossless for any payload.
+"""
+import numpy as np
+
+PLANE_NAMES = ("B", "G", "R", "rest")
+
+#Whole-row count and the (rows, pixels, 3) view of the pixels of a 24 bpp payload
+def _pixel_view(view, row_bytes):
+    rows = len(view) // row_bytes
+    stored = view[:rows * row_bytes].reshape(rows, row_bytes)
+    return stored, stored[:, :row_bytes // 3 * 3].reshape(rows, row_bytes // 3, 3)
+
+#Split a 24 bpp payload into B, G, R and rest planes, optionally as B-G and R-G
+def split_planes(data, row_bytes, subtract_green=False):
+    """Return four uint8 arrays. Without subtract_green the colour planes
+    are zero-copy strided views of data; with it B and R become B-G and R-G
+    modulo 256."""
+    view = np.frombuffer(data, dtype=np.uint8)
+    stored, pixels = _pixel_view(view, row_bytes)
+    blue, green, red = pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]
+    if subtract_green:
+        blue, red = blue - green, red - green
+    rest = np.concatenate([stored[:, row_bytes // 3 * 3:].reshape(-1), view[len(stored) * row_bytes:]])
+    return [blue, green, red, rest]
+
+#Interleave decoded planes back into the payload split_planes took them from
+def merge_planes(planes, row_bytes, subtract_green=False):
+    blue, green, red, rest = (np.frombuffer(plane, dtype=np.uint8) for plane in planes)
+    cols = row_bytes // 3
+    rows = len(green) // cols if cols else 0
+    spare = row_bytes - cols * 3
+    if len(blue) != rows * cols or len(red) != rows * cols or len(rest) < rows * spare:
+        raise ValueError("Planes do not match the row size")
+
+    out = np.empty(rows * row_bytes + len(rest) - rows * spare, dtype=np.uint8)
+    stored, pixels = _pixel_view(out, row_bytes)
+    pixels[:, :, 1] = green.reshape(rows, cols)
+    pixels[:, :, 0] = blue.reshape(rows, cols)
+    pixels[:, :, 2] = red.reshape(rows, cols)
+    if subtract_green:
+        pixels[:, :, 0] += pixels[:, :, 1]
+        pixels[:, :, 2] += pixels[:, :, 1]
+    stored[:, cols * 3:] = rest[:rows * spare].reshape(rows, spare)
+    out[rows * row_bytes:] = rest[rows * spare:]
+    return out.tobytes()
+
+#Byte histogram of every plane, for both the plain and the green-subtracted split
+def plane_histograms(data, row_bytes):
+    """Return {subtract_green: [4 histograms]}; G and rest are shared by both"""
+    plain = split_planes(data, row_bytes)
+    histograms = [np.bincount(plane.reshape(-1), minlength=256) for plane in plain]
+    blue, green, red = plain[0], plain[1], plain[2]
+    subtracted = [np.bincount((blue - green).reshape(-1), minlength=256), histograms[1],
+                  np.bincount((red - green).reshape(-1), minlength=256), histograms[3]]
+    return {False: histograms, True: subtracted}
@@ -0,0 +1,69 @@
+"""Mipmap pyramids so previews never resample the full-resolution image"""
+import numpy as np
+
+from .instrument import stage
+from .resize import scaled_size
+
+# Reductions stop once the longer side is at most this many pixels
+PYRAMID_MIN_SIZE = 64
+
+#2x2 box average with rounding; equal to resize_area(pixels, 0.5) but with no scratch sums
+def halve(pixels):
+    height, width = pixels.shape[0] // 2 * 2, pixels.shape[1] // 2 * 2
+    rows = pixels[0:height:2].astype(np.uint16)  # uint8 samples
+    rows += pixels[1:height:2]
+    sums = rows[:, 0:width:2] + rows[:, 1:width:2]
+    sums += 2
+    sums >>= 2
+    return sums.astype(pixels.dtype)
+
+#Largest scale, at most 1, at which a height x width image fits in the given box
+def fit_scale(height, width, max_height, max_width):
+    return min(1.0, max_height / height, max_width / width) if height and width else 1.0
+
+class ImagePyramid:
+    """A full-resolution image plus successive 2x box-filtered reductions of it.
+
+    Each level costs a quarter of the one above, so the whole pyramid is
+    built in about a third of a pass over the source.
+    """
+    def __init__(self, source, min_size=PYRAMID_MIN_SIZE):
+        self.levels = [source]
+        with stage("pyramid", source.nbytes) as s:
+            while max(self.levels[-1].shape[:2]) > min_size and min(self.levels[-1].shape[:2]) >= 2:
+                level = halve(self.levels[-1])
+                level.setflags(write=False)
+                self.levels.append(level)
+            s.bytes_out = self.nbytes
+
+    @property
+    def source(self):
+        return self.levels[0]
+
+    @property
+    def height(self):
+        return self.source.shape[0]
+
+    @property
+    def width(self):
+        return self.source.shape[1]
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels[1:])
+
+    def fit_scale(self, max_height, max_width):
+        return fit_scale(self.height, self.width, max_height, max_width)
+
+    #Smallest level at least scale times the source size, and the exact size to resize it to
+    def level_for_scale(self, scale):
+        """Return (level, (height, width)) so resizing level to that size gives the
+        source's size at scale, without resampling more pixels than needed. Levels
+        are floor-halved, so their aspect ratio drifts from the source's; the
+        target size is per axis so the output matches scaled_size exactly."""
+        target = scaled_size(self.height, self.width, scale)
+        for level in reversed(self.levels):
+            height, width = level.shape[:2]
+            if height >= target[0] and width >= target[1]:
+                return level, target
+        return self.source, target
@@ -0,0 +1,79 @@
+"""Vectorized image resizing for display"""
+import numpy as np
+
+RESIZE_METHODS = ("nearest", "area")
+
+#Output size of an image scaled by scale, truncated like the original set_size loop
+def scaled_size(height, width, scale):
+    return int(height * scale), int(width * scale)
+
+#Source index of every output row or column: int(i / scale), clipped to the source
+def nearest_indices(source_length, target_length, scale):
+    indices = (np.arange(target_length) / scale).astype(np.intp)
+    return np.minimum(indices, source_length - 1)
+
+#Output size and per-axis scales of a resize by scale, or to an exact (height, width) size
+def resize_target(height, width, scale, size=None):
+    """A size that scale gives anyway keeps scale on both axes, so sampling
+    stays identical to a resize by scale"""
+    if size is None or tuple(size) == scaled_size(height, width, scale):
+        return scaled_size(height, width, scale), (scale, scale)
+    return tuple(size), (size[0] / height, size[1] / width)
+
+#Nearest-neighbour resize with one gather per axis
+def resize_nearest(pixels, scale, size=None):
+    """Scale a (h, w, ...) array; identical to sampling pixels[int(i / scale), int(j / scale)].
+
+    size, as (height, width), sets the output size exactly instead, each
+    axis scaling by its own ratio. Returns the input itself when the size
+    does not change.
+    """
+    height, width = pixels.shape[:2]
+    (new_h, new_w), (scale_h, scale_w) = resize_target(height, width, scale, size)
+    if (new_h, new_w) == (height, width) and scale_h == scale_w == 1:
+        return pixels
+    if new_h == 0 or new_w == 0:
+        return np.zeros((new_h, new_w) + pixels.shape[2:], dtype=pixels.dtype)
+
+    rows = nearest_indices(height, new_h, scale_h)
+    cols = nearest_indices(width, new_w, scale_w)
+    # Gathering rows first means the column gather only touches kept rows
+    return pixels.take(rows, axis=0).take(cols, axis=1)
+
+#Area-average downscale: mean over whole factor x factor blocks, then nearest to the exact size
+def resize_area(pixels, scale, size=None):
+    """Average blocks of int(1 / scale) pixels in each direction, then finish with a
+    nearest-neighbour pass to reach the same size as resize_nearest.
+    Upscaling and scales above 1/2 fall back to resize_nearest."""
+    height, width = pixels.shape[:2]
+    (new_h, new_w), scales = resize_target(height, width, scale, size)
+    factor = int(1 / max(scales)) if min(scales) > 0 else 0
+    if factor < 2 or new_h == 0 or new_w == 0:
+        return resize_nearest(pixels, scale, size)
+
+    block_h, block_w = height // factor, width // factor
+    blocks = pixels[:block_h * factor, :block_w * factor]
+
+    # Separable box sum over strided views: rows first, then columns of the row sums
+    row_dtype = np.uint16 if factor * 255 < 1 << 16 else np.uint32  # uint8 samples
+    row_sums = np.zeros((block_h, block_w * factor) + pixels.shape[2:], dtype=row_dtype)
+    for dy in range(factor):
+        row_sums += blocks[dy::factor]
+    sums = np.zeros((block_h, block_w) + pixels.shape[2:], dtype=np.uint32)
+    for dx in range(factor):
+        sums += row_sums[:, dx::factor]
+    area = factor * factor
+    averaged = ((sums + area // 2) // area).astype(pixels.dtype)
+
+    # The remaining scale maps the block grid onto the requested size
+    rows = np.minimum((np.arange(new_h) * block_h) // new_h, block_h - 1)
+    cols = np.minimum((np.arange(new_w) * block_w) // new_w, block_w - 1)
+    return averaged.take(rows, axis=0).take(cols, axis=1)
+
+#Resize with the named method, by scale or to an exact (height, width) size
+def resize_image(pixels, scale, method="nearest", size=None):
+    if method == "nearest":
+        return resize_nearest(pixels, scale, size)
+    elif method == "area":
+        return resize_area(pixels, scale, size)
+    raise ValueError(f"Unknown resize method: {method}")
@@ -0,0 +1,173 @@
+"""Run-length coding of the pixel payload"""
+import numpy as np
+
+from .instrument import timed_stage
+
+# Input bytes tokenized per vectorized pass of the RLE encoder
+RLE_CHUNK = 1 << 20
+# Longest literal block; a count byte of 0xFF would read back as a run marker
+RLE_MAX_LITERAL = 254
+# Bytes past a token start that decide where the token ends
+RLE_LOOKAHEAD = 260
+
+#Split data into the RLE parse, one chunk at a time
+def rle_tokens(data):
+    """Yield (segment, starts, ends, is_run) for each chunk of the input.
+
+    starts/ends index into `segment`, a view of the input. Runs are 4-255
+    equal bytes; a literal block stops where a run of 4 starts, where the
+    last 3 bytes were equal, or after RLE_MAX_LITERAL bytes. Tokens are
+    found by computing every position's successor with NumPy and then
+    following the chain from the first byte.
+    """
+    source = np.frombuffer(data, dtype=np.uint8)
+    n = len(source)
+    pos = 0
+    
+    for chunk_start in range(0, n, RLE_CHUNK):
+        chunk_end = min(chunk_start + RLE_CHUNK, n)
+        if pos >= chunk_end:
+            continue
+        
+        # Two bytes of history for the 3-equal check, plus lookahead
+        base = max(0, chunk_start - 2)
+        segment = source[base:min(n, chunk_end + RLE_LOOKAHEAD)]
+        m = len(segment)
+        idx = np.arange(m)
+        
+        # Length of the run of equal bytes starting at every position
+        change = np.flatnonzero(segment[1:] != segment[:-1]) + 1
+        run_ends = np.append(change, m)
+        run_id = np.zeros(m, dtype=np.intp)
+        run_id[change] = 1
+        run_length = run_ends[np.cumsum(run_id)] - idx
+        
+        # Positions a literal block stops before
+        stop = np.ones(m + 1, dtype=bool)
+        stop[:m] = run_length >= 4
+        stop[2:m] |= (segment[2:] == segment[1:-1]) & (segment[1:-1] == segment[:-2])
+        if base == 0 and m > 1:
+            # The original scan compared data[-1] at i == 1
+            stop[1] |= bool(segment[1] == segment[0] == source[-1])
+        stop[0] = False
+        next_stop = np.where(stop, np.arange(m + 1), m + 1)
+        next_stop = np.minimum.accumulate(next_stop[::-1])[::-1]
+        
+        literal_end = np.minimum(next_stop[1:], idx + RLE_MAX_LITERAL)
+        successor = np.where(run_length >= 4, idx + np.minimum(run_length, 255), literal_end)
+        
+        steps = memoryview(successor)
+        starts = []
+        p = pos - base
+        limit = chunk_end - base
+        while p < limit:
+            starts.append(p)
+            p = steps[p]
+        pos = base + p
+        
+        starts = np.array(starts, dtype=np.intp)
+        yield segment, starts, successor[starts], run_length[starts] >= 4
+
+#Compress data using Run-Length Encoding
+@timed_stage("rle_encode")
+def rle_compress(data):
+    if len(data) == 0:
+        return bytes()
+    
+    chunks = []
+    for segment, starts, ends, is_run in rle_tokens(data):
+        lengths = ends - starts
+        # Runs are [0xFF, count, byte], literals are [count, bytes...]
+        sizes = np.where(is_run, 3, 1 + lengths)
+        offsets = np.cumsum(sizes) - sizes
+        compressed = np.empty(int(sizes.sum()), dtype=np.uint8)
+        
+        compressed[offsets[is_run]] = 0xFF
+        compressed[offsets[is_run] + 1] = lengths[is_run]
+        compressed[offsets[is_run] + 2] = segment[starts[is_run]]
+        
+        is_literal = ~is_run
+        literal_lengths = lengths[is_literal]
+        compressed[offsets[is_literal]] = literal_lengths
+        copy_from = np.repeat(starts[is_literal], literal_lengths)
+        copy_to = np.repeat(offsets[is_literal] + 1, literal_lengths)
+        within = np.arange(len(copy_from)) - np.repeat(np.cumsum(literal_lengths) - literal_lengths, literal_lengths)
+        compressed[copy_to + within] = segment[copy_from + within]
+        
+        chunks.append(compressed.tobytes())
+    
+    return b''.join(chunks)
+
+#Size and byte histogram of rle_compress(data), without building it
+@timed_stage("rle_scan")
+def rle_statistics(data):
+    size = 0
+    histogram = np.zeros(256, dtype=np.int64)
+    for segment, starts, ends, is_run in rle_tokens(data):
+        lengths = ends - starts
+        runs = int(np.count_nonzero(is_run))
+        size += 3 * runs + int((1 + lengths[~is_run]).sum())
+        
+        # Run markers, run counts and run bytes
+        histogram[0xFF] += runs
+        histogram += np.bincount(lengths[is_run], minlength=256)
+        histogram += np.bincount(segment[starts[is_run]], minlength=256)
+        
+        # Literal counts and the literal bytes themselves
+        histogram += np.bincount(lengths[~is_run], minlength=256)
+        coverage = np.zeros(len(segment) + 1, dtype=np.int8)
+        coverage[starts[~is_run]] += 1
+        coverage[ends[~is_run]] -= 1
+        histogram += np.bincount(segment[np.cumsum(coverage[:-1]) > 0], minlength=256)
+    
+    return size, histogram
+
+# Every run a token can decode, sliced to the run's count
+_RUN_BYTES = [bytes([byte]) * 255 for byte in range(256)]
+# Back-to-back full literal blocks copied per NumPy pass of the RLE decoder
+RLE_DECODE_BLOCKS = 1 << 12
+
+#Decompress RLE encoded data
+@timed_stage("rle_decode")
+def rle_decompress(data):
+    """Token boundaries depend on every earlier count byte, so tokens are
+    walked in order, each adding one slice to the output. Incompressible
+    data encodes as back-to-back literal blocks of RLE_MAX_LITERAL bytes;
+    those are found with a strided view and copied in one NumPy pass."""
+    source = np.frombuffer(data, dtype=np.uint8)
+    pieces = []
+    append = pieces.append
+    i = 0
+    n = len(data)
+    block = RLE_MAX_LITERAL + 1
+    
+    # Before the last 256 bytes no token can be cut short by the end of the data
+    safe = n - 256
+    while i < safe:
+        count_byte = data[i]
+        if count_byte == 0xFF:  # RLE sequence
+            append(_RUN_BYTES[data[i + 2]][:data[i + 1]])
+            i += 3
+        elif count_byte == RLE_MAX_LITERAL and i + block < safe and data[i + block] == RLE_MAX_LITERAL:
+            full = source[i:min(safe, i + block * RLE_DECODE_BLOCKS):block] == RLE_MAX_LITERAL
+            blocks = len(full) if full.all() else int(full.argmin())
+            append(source[i:i + blocks * block].reshape(blocks, block)[:, 1:].tobytes())
+            i += blocks * block
+        else:  # Literal sequence
+            append(data[i + 1:i + 1 + count_byte])
+            i += 1 + count_byte
+    
+    while i < n:
+        count_byte = data[i]
+        i += 1
+        
+        if count_byte == 0xFF:  # RLE sequence
+            if i + 1 < n:
+                append(_RUN_BYTES[data[i + 1]][:data[i]])
+                i += 2
+        else:  # Literal sequence
+            if i + count_byte <= n:
+                append(data[i:i + count_byte])
+                i += count_byte
+    
+    return b''.join(pieces)
@@ -0,0 +1,132 @@
+"""Constant-memory streaming between BMP files and block .cmpt365 files"""
+import functools
+from collections import deque
+
+from .bmp import BMP_HEADER_SIZE, BMPReader, build_bmp_header
+from .codec import PARALLEL_MIN_BYTES, compress_block, decompress_block, get_process_pool, iter_decompress_payload
+from .container import (BLOCK_CONTAINER_VERSION, BLOCK_INDEX_ENTRY_SIZE, BLOCK_INDEX_HEADER_SIZE,
+                        block_ranges, build_cmpt365, default_rows_per_block, pack_block_index,
+                        read_cmpt365_header, unpack_block_index)
+from .instrument import stage
+
+# Blocks submitted to the pool ahead of the one being written; together with
+# the block size this bounds how much pixel data is held in memory at once
+STREAM_WINDOW = 4
+
+#Map a worker task over an iterable, yielding results in order with a bounded number in flight
+def iter_bounded_map(task, items, executor=None, window=STREAM_WINDOW):
+    if executor is None:
+        yield from map(task, items)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(task, item))
+        if len(pending) > window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+#Copy the pixel payload out of a mapping one block at a time
+def iter_pixel_blocks(pixel_bytes, row_bytes, rows_per_block=None, rows=None):
+    """rows, a (height, row_bytes) view of the rows in bottom-up order, stands
+    in for the rows of pixel_bytes; bytes after the rows still come from it"""
+    for start, end in block_ranges(len(pixel_bytes), row_bytes, rows_per_block):
+        if rows is None:
+            yield bytes(pixel_bytes[start:end])
+            continue
+        block_rows = rows[start // row_bytes:min(end, rows.size) // row_bytes].tobytes()
+        yield block_rows + bytes(pixel_bytes[max(start, rows.size):end])
+
+#Yield the decompressed pixel payload of an open .cmpt365 file, positioned after its color table
+def iter_cmpt365_payload(f, method, padding, table_len, executor=None):
+    """Block files are read and decoded one block at a time; older single
+    method files have a single payload, which Huffman-only methods still
+    decode and yield one chunk at a time."""
+    table_bytes = f.read(table_len)
+    if method != 5:
+        yield from iter_decompress_payload(method, padding, table_bytes, f.read())
+        return
+    if padding != BLOCK_CONTAINER_VERSION:
+        raise ValueError(f"Unsupported block container version: {padding}")
+    
+    payload_start = f.tell()
+    entries = unpack_block_index(table_bytes)
+    if executor is None and len(entries) > 1 and sum(entry[3] for entry in entries) >= PARALLEL_MIN_BYTES:
+        executor = get_process_pool()
+    
+    def read_blocks():
+        for block_method, block_padding, block_table_len, payload_len, offset in entries:
+            with stage("read") as s:
+                f.seek(payload_start + offset)
+                block_table = f.read(block_table_len)
+                block_payload = f.read(payload_len)
+                s.bytes_out = len(block_table) + len(block_payload)
+            if len(block_payload) < payload_len:
+                raise ValueError("Block payload is truncated")
+            yield block_method, block_padding, block_table, block_payload
+    
+    yield from iter_bounded_map(decompress_block, read_blocks(), executor)
+
+#Compress a BMP file into a block .cmpt365 file without holding the whole image in memory
+def compress_stream(in_file, out_file, rows_per_block=None, executor=None):
+    """Stream the BMP at path in_file into a method 5 file at path out_file.
+
+    The input is memory-mapped and copied out one block at a time; each
+    block gets its own histogram pass before it is Huffman coded, and the
+    block index is written last into space reserved after the header.
+    Rows of top-down inputs are taken in reverse, since the payload is
+    always stored bottom-up. Returns the size of the written file.
+    """
+    with BMPReader(in_file) as reader:
+        rows_per_block = rows_per_block or default_rows_per_block(reader.row_bytes)
+        pixel_bytes = reader.pixel_bytes
+        block_count = len(block_ranges(len(pixel_bytes), reader.row_bytes, rows_per_block))
+        if executor is None and block_count > 1 and len(pixel_bytes) >= PARALLEL_MIN_BYTES:
+            executor = get_process_pool()
+        
+        index_len = BLOCK_INDEX_HEADER_SIZE + BLOCK_INDEX_ENTRY_SIZE * block_count
+        header = build_cmpt365(reader.width, reader.height, reader.bpp, 5, BLOCK_CONTAINER_VERSION,
+                               reader.color_table, bytes(index_len), bytes())
+        
+        with open(out_file, 'wb') as f:
+            f.write(header)
+            entries = []
+            offset = 0
+            bottom_up_rows = reader.raw_rows()[::-1] if reader.top_down else None
+            blocks = iter_pixel_blocks(pixel_bytes, reader.row_bytes, rows_per_block, bottom_up_rows)
+            task = functools.partial(compress_block, row_bytes=reader.row_bytes, bpp=reader.bpp)
+            for method, padding, table_bytes, payload in iter_bounded_map(task, blocks, executor):
+                entries.append((method, padding, len(table_bytes), len(payload), offset))
+                f.write(table_bytes)
+                f.write(payload)
+                offset += len(table_bytes) + len(payload)
+            
+            # Fill in the index now that every block's size is known
+            f.seek(len(header) - index_len)
+            f.write(pack_block_index(rows_per_block, entries))
+        pixel_bytes.release()
+    return len(header) + offset
+
+#Decompress a .cmpt365 file back into an uncompressed BMP file, block by block
+def decompress_stream(in_file, out_file, executor=None):
+    """Write the BMP stored in the .cmpt365 file at path in_file to path out_file.
+
+    Block files are decoded one block at a time, so memory stays bounded by
+    the block size. Returns the size of the written file.
+    """
+    with open(in_file, 'rb') as src:
+        width, height, bpp, method, padding, color_table_len, table_len = read_cmpt365_header(src)
+        color_table = src.read(color_table_len)
+        
+        with open(out_file, 'wb') as f:
+            # The sizes in the header are patched once the payload is written
+            f.write(build_bmp_header(width, height, bpp, color_table, 0))
+            f.write(color_table)
+            pixel_size = 0
+            for chunk in iter_cmpt365_payload(src, method, padding, table_len, executor):
+                f.write(chunk)
+                pixel_size += len(chunk)
+            
+            f.seek(0)
+            f.write(build_bmp_header(width, height, bpp, color_table, pixel_size))
+    return BMP_HEADER_SIZE + len(color_table) + pixel_size
@@ -0,0 +1,128 @@
+"""Background jobs for the viewer: a queue of cancellable tasks run on worker threads
+
+Workers never call back into the GUI. They only update the task, and the
+thread that owns the callbacks (tkinter's main loop) calls poll()
+periodically to deliver progress, results and errors:
+
+    tasks = TaskQueue()
+    tasks.submit("Opening image.bmp", read_image, "image.bmp", on_done=show)
+    window.after(50, poll)  # where poll() calls tasks.poll() and reschedules itself
+
+Every instrumented stage a task runs is also a cancellation point, so
+codecs need no extra checks to be cancelled between stages.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrument import recording
+
+class Cancelled(Exception):
+    """Raised inside a task once it has been cancelled"""
+
+class Task:
+    """One queued call of fn(task, *args); fn reports progress and checks for cancellation through task"""
+    def __init__(self, label, fn, args, on_done=None, on_error=None, on_progress=None):
+        self.label = label
+        self.fn = fn
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.progress = None  # fraction done, when the task knows it
+        self.status = "queued"
+        self.partial = None  # result so far, for tasks that publish one
+        self.stats = None
+        self.seconds = None
+        self.future = None
+        self._cancel = threading.Event()
+        self._reported = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None:
+            self.future.cancel()  # only succeeds while still queued
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled(self.label)
+
+    #Called from the worker; also a cancellation point
+    def report(self, progress=None, status=None):
+        self.check()
+        if progress is not None:
+            self.progress = progress
+        if status is not None:
+            self.status = status
+
+    def describe(self):
+        if self.progress is None:
+            return f"{self.label}: {self.status}"
+        return f"{self.label}: {self.status} {self.progress:.0%}"
+
+class TaskQueue:
+    """Runs submitted tasks on max_workers threads, in submission order for one worker
+
+    Callbacks run only inside poll(), on the polling thread:
+    on_done(task, result), on_error(task, exception) and on_progress(task).
+    A cancelled task's on_error gets a Cancelled exception.
+    """
+    def __init__(self, max_workers=1):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="cmpt365-task")
+        self.tasks = []
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def submit(self, label, fn, *args, on_done=None, on_error=None, on_progress=None):
+        task = Task(label, fn, args, on_done, on_error, on_progress)
+        task.future = self.executor.submit(self._run, task)
+        self.tasks.append(task)
+        return task
+
+    def _run(self, task):
+        task.report(status="running")
+        started = time.perf_counter()
+        # Every stage that finishes reports its name and checks for cancellation
+        with recording(hook=lambda stage_stats: task.report(status=stage_stats.name)) as stats:
+            result = task.fn(task, *task.args)
+        task.seconds = time.perf_counter() - started
+        task.stats = stats
+        return result
+
+    @property
+    def current(self):
+        """The first unfinished task, if any"""
+        for task in self.tasks:
+            if not task.future.done():
+                return task
+        return None
+
+    def cancel_all(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def poll(self):
+        """Deliver progress of running tasks and the outcome of finished ones"""
+        for task in list(self.tasks):
+            if not task.future.done():
+                state = (task.progress, task.status)
+                if task.on_progress is not None and state != task._reported:
+                    task._reported = state
+                    task.on_progress(task)
+                continue
+            self.tasks.remove(task)
+            error = Cancelled(task.label) if task.future.cancelled() else task.future.exception()
+            if error is None:
+                if task.on_done is not None:
+                    task.on_done(task, task.future.result())
+            elif task.on_error is not None:
+                task.on_error(task, error)
+
+    def shutdown(self, wait=False):
+        self.cancel_all()
+        self.executor.shutdown(wait=wait, cancel_futures=True)
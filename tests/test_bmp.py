@@ -0,0 +1,21 @@
+"""Lazy BMP reading"""
+import numpy as np
+import pytest
+
+from cmpt365.bmp import BMPReader, bmp_row_bytes, build_bmp_header
+
+#Write a width x height BMP of random pixel bytes and return its path
+def write_bmp(path, width, height, bpp, seed=0):
+    rng = np.random.default_rng(seed)
+    color_table = rng.integers(0, 256, 4 * (1 << bpp), dtype=np.uint8).tobytes() if bpp <= 8 else bytes()
+    pixels = rng.integers(0, 256, bmp_row_bytes(width, bpp) * height, dtype=np.uint8).tobytes()
+    path.write_bytes(build_bmp_header(width, height, bpp, color_table, len(pixels)) + color_table + pixels)
+    return str(path)
+
+@pytest.mark.parametrize("bpp", [1, 4, 8, 24])
+def test_decode_tile_clamps_rectangles_past_the_edges(tmp_path, bpp):
+    path = write_bmp(tmp_path / "image.bmp", 10, 4, bpp)
+    with BMPReader(path) as reader:
+        full = reader.decode()
+        assert np.array_equal(reader.decode_tile(8, 0, 5, 2), full[0:2, 8:10])
+        assert np.array_equal(reader.decode_tile(3, 2, 20, 9), full[2:4, 3:10])
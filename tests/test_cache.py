@@ -0,0 +1,18 @@
+"""Decoded image caching"""
+import numpy as np
+
+from cmpt365.cache import DecodeCache
+
+def test_put_leaves_the_callers_array_writable(tmp_path):
+    path = tmp_path / "image.bmp"
+    path.write_bytes(b"BM")
+    pixels = np.zeros((4, 5, 3), dtype=np.uint8)
+    cache = DecodeCache(directory=str(tmp_path / "cache"))
+
+    cached = cache.put(str(path), pixels)
+    assert pixels.flags.writeable
+    assert not cached.flags.writeable
+    assert not cache.get(str(path)).flags.writeable
+
+    pixels[0, 0] = 255
+    assert np.array_equal(cache.get(str(path)), pixels)
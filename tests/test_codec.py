@@ -0,0 +1,19 @@
+"""Size prediction and method selection"""
+import pytest
+
+from cmpt365.bmp import bmp_row_bytes
+from cmpt365.codec import predict_sizes, select_method_sampled
+
+#Stored payload and colour table of a single-colour paletted image
+def flat_paletted(width, height, bpp):
+    row_bytes = bmp_row_bytes(width, bpp)
+    color_table = bytes(4 * (1 << bpp))
+    return bytes(row_bytes * height), color_table, row_bytes
+
+@pytest.mark.parametrize("bpp", [1, 4, 8])
+def test_sampled_choice_matches_prediction_on_flat_paletted_image(bpp):
+    pixels, color_table, row_bytes = flat_paletted(640, 480, bpp)
+    sizes = predict_sizes(pixels, color_table, row_bytes, bpp)
+    method, _, fraction = select_method_sampled(pixels, color_table, row_bytes, bpp, min_bytes=0)
+    assert fraction < 1
+    assert method == min(sizes, key=sizes.get)
@@ -0,0 +1,22 @@
+"""Preview pyramid and resizing from its levels"""
+import numpy as np
+import pytest
+
+from cmpt365.adjust import ImageAdjuster
+from cmpt365.resize import resize_image, scaled_size
+
+@pytest.mark.parametrize("method", ["nearest", "area"])
+@pytest.mark.parametrize("scale", [0.9, 0.5, 0.37, 0.1, 0.013])
+def test_resized_from_pyramid_level_has_the_exact_scaled_size(method, scale):
+    # Odd sides make floor-halved levels drift from the source's aspect ratio
+    source = np.random.default_rng(0).integers(0, 256, (1081, 1919, 3), dtype=np.uint8)
+    image = ImageAdjuster(source).resized(scale, method)
+    assert image.shape == scaled_size(1081, 1919, scale) + (3,)
+
+def test_full_resolution_level_samples_like_a_plain_resize():
+    source = np.random.default_rng(1).integers(0, 256, (101, 203, 3), dtype=np.uint8)
+    adjuster = ImageAdjuster(source)
+    level, size = adjuster.pyramid.level_for_scale(0.7)
+    assert level is source
+    assert size == scaled_size(101, 203, 0.7)
+    assert np.array_equal(adjuster.resized(0.7), resize_image(source, 0.7))